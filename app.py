@@ -7,6 +7,13 @@ import subprocess
 
 import json
 import logging
+import os
+import sys
+
+# the web app shares modules with the calendar bot (logfiles, intervals), they are imported from the app directory.
+# This is the only place that sets up the path, the modules of the web app import them like their own modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+import logfiles
 
 def read_json(path):
     with open(path) as f:
@@ -15,7 +22,7 @@ def read_json(path):
 app = Flask(__name__)
 
 # Configure the Flask app logger
-file_handler = logging.FileHandler('app/log/server.log')
+file_handler = logfiles.RotatingLogHandler('app/log/server.log')
 file_handler.setFormatter(logging.Formatter('%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s', "%Y-%m-%d_%H:%M:%S"))
 app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
@@ -42,6 +49,12 @@ Section for App-specific functions
 
 from icalendar import Calendar, Event
 
+from datetime import datetime
+
+import artifacts
+import calendardata
+import monitoring
+
 def start():
     global program_status
     time.sleep(5)
@@ -60,28 +73,85 @@ def return_calendar_view(calendar):
 
 @app.route('/calendar/subscribe/<calendar>')
 def return_calendar_subscription(calendar):
-    with open('app/' + calendar + '.ics', 'r') as f:
-        ics_file = f.read()
-    return Response(ics_file, mimetype='text/calendar')
+    return artifacts.send_artifact('app/' + calendar + '.ics', 'text/calendar')
 
 @app.route('/calendar/json/<calendar>')
 def return_calendar_json(calendar):
-    with open('app/' + calendar + '.json', 'r') as f:
-        ics_file = f.read()
-    return Response(ics_file, mimetype='text/calendar')
+    # FullCalendar asks only for the visible range, without a range the whole calendar is sent
+    if 'start' not in request.args and 'end' not in request.args:
+        return artifacts.send_artifact('app/' + calendar + '.json', 'text/calendar')
+    try:
+        start = datetime.fromisoformat(request.args['start'])
+        end = datetime.fromisoformat(request.args['end'])
+        events = calendardata.get_compact_events_between(calendar, start, end)
+    except (KeyError, ValueError):
+        return jsonify(error="start and end must be in iso format"), 400
+    except FileNotFoundError:
+        abort(404)
+    response = jsonify(events)
+    response.cache_control.max_age = artifacts.MAX_AGE
+    return response
 
 
 @app.route('/conan-calendar.ics')
 def conan_calendar_ics():
-    with open('app/conan-calendar.ics', 'r') as f:
-        ics_file = f.read()
-    return Response(ics_file, mimetype='text/calendar')
+    return artifacts.send_artifact('app/conan-calendar.ics', 'text/calendar')
+
+@app.route('/conan-calendar-partial.ics')
+def conan_calendar_partial_ics():
+    return artifacts.send_artifact('app/conan-calendar-partial.ics', 'text/calendar')
 
 import caldove
 @app.route('/calendar/api/caldove')
 def caldove_route():
     return caldove.generate_site()
 
+import availability
+@app.route('/calendar/availability')
+def calendar_availability():
+    """
+    Returns the times in which all selected sources are free, e.g.
+    /calendar/availability?sources=Olli,Linda&from=2023-05-01T00:00&to=2023-05-08T00:00
+    Without sources the query lists all sources that can be selected.
+    """
+    try:
+        if not request.args.get('sources'):
+            return jsonify(sources=availability.get_sources())
+        source_ids = []
+        for key in request.args['sources'].split(','):
+            source_id = availability.find_source(key.strip())
+            if source_id is None:
+                return jsonify(error="unknown source: " + key), 400
+            source_ids.append(source_id)
+        start = availability.parse_time(request.args.get('from'), None)
+        end = availability.parse_time(request.args.get('to'), None)
+    except FileNotFoundError:
+        return jsonify(error="no busy times generated yet"), 503
+    except ValueError:
+        return jsonify(error="times must be in iso format"), 400
+    free_times = availability.find_common_free_times(source_ids, start, end)
+    return jsonify(free=[{'start': start.isoformat(), 'end': end.isoformat()} for start, end in free_times])
+
+@app.route('/calendar/free')
+def calendar_free():
+    """
+    Returns the times in which all sources are free for at least min minutes (150 by default), e.g.
+    /calendar/free?min=120&from=2023-05-01T00:00&to=2023-05-08T00:00
+    from and to have to be within the next eight weeks, the window the busy times are generated for
+    """
+    try:
+        min_duration = float(request.args.get('min', 150)) * 60
+        start = availability.parse_time(request.args.get('from'), None)
+        end = availability.parse_time(request.args.get('to'), None)
+        free_times = availability.find_free_slots(min_duration, start, end)
+    except FileNotFoundError:
+        return jsonify(error="no busy times generated yet"), 503
+    except availability.PeriodError as e:
+        return jsonify(error=str(e)), 400
+    except ValueError:
+        return jsonify(error="min must be a number and times must be in iso format"), 400
+    return jsonify(free=[{'start': start.isoformat(), 'end': end.isoformat()} for start, end in free_times])
+
 @app.route('/conan-calendar')
 def conan_calendar():
     return render_template('calendar.html',  calendar_url="conan-calendar.ics")
@@ -90,9 +160,7 @@ def conan_calendar():
 @app.route('/invert-conan-calendar.ics')
 @basic_auth.required
 def invert_conan_calendar_ics():
-    with open('app/invert-conan-calendar.ics', 'r') as f:
-        ics_file = f.read()
-    return Response(ics_file, mimetype='text/calendar')
+    return artifacts.send_artifact('app/invert-conan-calendar.ics', 'text/calendar', private=True)
 
 
 @app.route('/invert-conan-calendar')
@@ -122,40 +190,50 @@ def secret_page():
 @app.route('/status')
 def status():
     global program_status
-    return jsonify(status=program_status)
+    if program_status != "success":
+        return jsonify(status=program_status)
+    # the health of the jobs is reported by the calendar bot itself
+    pipeline_status, jobs = monitoring.get_status()
+    return jsonify(status=pipeline_status, jobs=jobs)
+
+@app.route('/metrics')
+def metrics():
+    return Response(monitoring.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 '''
 -----------------------------------------------------
 Logs
 '''
 
+# number of log entries on a page
+LOG_PAGE_SIZE = 100
+
+def render_logs(path):
+    """
+    Renders a page of the newest entries of a log file. The query parameters level and q filter the entries
+    by their level and by a text in their message, the cursor parameter selects the next older page.
+    """
+    level = request.args.get('level') or None
+    text = request.args.get('q') or None
+    try:
+        limit = min(max(int(request.args.get('limit', LOG_PAGE_SIZE)), 1), 1000)
+        log_messages, cursor = logfiles.read_entries(path, limit, request.args.get('cursor'), level, text)
+    except ValueError:
+        abort(400)
+    except FileNotFoundError:
+        log_messages, cursor = [], None
+    return render_template('logs.html', log_messages=log_messages, cursor=cursor, level=level or '', text=text or '',
+                           limit=limit, levels=logfiles.LEVELS)
+
 @app.route('/logs/application')
 @basic_auth.required
 def logs():
-    log_messages = []
-    with open('app/log/application.log', 'r') as logfile:
-        for line in logfile:
-            try:
-                time, application, log_type, message = line.strip().split(' ', 3)
-                log_messages.append({'time': time, 'application': application, 'type': log_type, 'message': message})
-            except Exception as e:
-                print("Parse Error for log event:" + line)
-    log_messages = log_messages[::-1]  # Reverse the order of the messages to display the latest message first
-    return render_template('logs.html', log_messages=log_messages)
+    return render_logs('app/log/application.log')
 
 @app.route('/logs/server')
 @basic_auth.required
 def server_logs():
-    log_messages = []
-    with open('app/log/server.log', 'r') as logfile:
-        for line in logfile:
-            try:
-                time, application, log_type, message = line.strip().split(' ', 3)
-                log_messages.append({'time': time, 'application': application, 'type': log_type, 'message': message})
-            except Exception as e:
-                print("Parse Error for log event:" + line)
-    log_messages = log_messages[::-1]  # Reverse the order of the messages to display the latest message first
-    return render_template('logs.html', log_messages=log_messages)
+    return render_logs('app/log/server.log')
 
 
 @app.route('/activate', methods=['POST'])
@@ -1,20 +1,85 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+import threading
 
-logging.basicConfig(filename="log/application.log",
-                            filemode='a',
-                            format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
-                            datefmt='%H:%M:%S',
-                            level=logging.INFO)
+import logfiles
 
+# fields that are added to every entry logged by the current thread, e.g. the name of the running job
+context = threading.local()
 
-def error(message):
-    print(message)
-    logging.error(message)
 
-def info(message):
-    print(message)
-    logging.info(message)
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single json line with the time, level, logger and message of the record
+    and the structured fields that were passed to error, info or debug.
+    """
 
-def debug(message):
-    print(message)
-    logging.debug(message)
\ No newline at end of file
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+file_handler = logfiles.RotatingLogHandler("log/application.log")
+file_handler.setFormatter(JsonFormatter())
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(message)s'))
+
+# the pipeline only puts records into the queue, a background thread writes them to the console and the file
+log_queue = queue.SimpleQueue()
+listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+listener.start()
+# write the records that are still in the queue when the process ends
+atexit.register(listener.stop)
+
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(handlers=[queue_handler], level=logging.INFO)
+
+
+def get_context():
+    return dict(getattr(context, "fields", {}))
+
+
+def set_context(**fields):
+    """
+    Sets the fields that are added to every entry the current thread logs, e.g. set_context(job="calendar").
+    """
+    context.fields = fields
+
+
+def run_with_context(fields, function, *args):
+    """
+    Calls the function with the given context, so that a function running in a worker thread logs with the
+    context of the thread that started it.
+    """
+    previous = get_context()
+    set_context(**fields)
+    try:
+        return function(*args)
+    finally:
+        set_context(**previous)
+
+
+def log(level, message, fields):
+    logging.log(level, message, extra={"fields": dict(get_context(), **fields)})
+
+
+def error(message, **fields):
+    log(logging.ERROR, message, fields)
+
+def info(message, **fields):
+    log(logging.INFO, message, fields)
+
+def debug(message, **fields):
+    log(logging.DEBUG, message, fields)
@@ -1,6 +1,5 @@
 import icalendar
 import datetime
-import requests
 from icalendar import vRecur
 from datetime import timedelta
 from datetime import time as dttime
@@ -8,48 +7,76 @@ import dateutil.rrule as rrule
 import pytz
 from icalendar import Event, vDatetime
 import icaltools
-import recurring_ical_events
+import expansion
+import intervals
+import publish
+import eventstore
+import metrics
 import schedule
 import re
 import time
 import applog
 import json
+import hashlib
+import concurrent.futures
+import concurrent.futures.process
 
-def invert_events(events, start, end):
-    free_times = find_free_times(events, start, end)
-    return create_ical_events_from_timespans(free_times)
-
-
-def generate_sleep_events(timespan_start, timespan_end):
+def generate_sleep_intervals(timespan_start, timespan_end, sleep_start_time=dttime(22, 0), sleep_end_time=dttime(9, 0), weekdays=None):
     """
-    This function generates a list of events with the summary "Sleeping" for each day included in the timespan.
-    The events will have a start time of 22:00 of the day before and an end time of 9:00 on the current day.
+    This function generates the sleep times for each day included in the timespan.
+    Every sleep time ends at sleep_end_time on the current day and starts at sleep_start_time,
+    on the day before if the sleep time passes midnight (by default from 22:00 to 9:00).
+    With weekdays only the sleep times that start on one of these weekdays are generated.
 
     :param timespan_start: A timezone-aware datetime object representing the start of the timespan
     :param timespan_end: A timezone-aware datetime object representing the end of the timespan
-    :return: A list of icalendar.Event objects
+    :param sleep_start_time: A datetime.time object representing the start of the sleep time
+    :param sleep_end_time: A datetime.time object representing the end of the sleep time
+    :param weekdays: A collection of weekdays (0 is monday) or None for every day
+    :return: An interval set (see intervals.py)
     """
-    tz = timespan_start.tzinfo
-    sleep_start_time = dttime(22, 0, tzinfo=tz)
-    sleep_end_time = dttime(9, 0, tzinfo=tz)
-    events = []
+    # the times are local times of every single day, so the utc offset of the day has to be used
+    tz = pytz.timezone(timespan_start.tzinfo.zone) if hasattr(timespan_start.tzinfo, "zone") else timespan_start.tzinfo
+
+    def localize(day, time_of_day):
+        local_time = datetime.datetime.combine(day, time_of_day)
+        return tz.localize(local_time) if hasattr(tz, "localize") else local_time.replace(tzinfo=tz)
+
+    days_before = 1 if sleep_start_time >= sleep_end_time else 0
+    sleep_times = []
     current_day = timespan_start
     while current_day <= timespan_end:
-        sleep_start = current_day.replace(hour=sleep_start_time.hour, minute=sleep_start_time.minute, tzinfo=tz) - timedelta(days=1)
-        sleep_end = current_day.replace(hour=sleep_end_time.hour, minute=sleep_end_time.minute, tzinfo=tz)
+        sleep_start = localize(current_day.date() - timedelta(days=days_before), sleep_start_time)
+        sleep_end = localize(current_day.date(), sleep_end_time)
+        if weekdays is None or sleep_start.weekday() in weekdays:
+            sleep_times.append((sleep_start, sleep_end))
+        current_day += timedelta(days=1)
+    return intervals.from_pairs(sleep_times)
+
+
+def generate_sleep_events(sleep_times, tz, summary="Sleeping"):
+    """
+    This function generates a list of events with the given summary for the given sleep times.
+
+    :param sleep_times: An interval set (see intervals.py)
+    :param tz: The timezone of the generated events
+    :param summary: The summary of the generated events
+    :return: A list of icalendar.Event objects
+    """
+    events = []
+    for sleep_start, sleep_end in intervals.to_datetimes(sleep_times, tz):
         event = icaltools.new_event()
-        event.add('SUMMARY', "Sleeping")
+        event.add('SUMMARY', summary)
         event.add('DTSTART', sleep_start)
         event.add('DTEND', sleep_end)
         events.append(event)
-        current_day += timedelta(days=1)
     return events
 
 
-def create_ical_events_from_timespans(free_times):
+def create_ical_events_from_timespans(free_times, summary='Möglicher Conan Termin'):
     """
     This function takes a list of timespans and returns a list of iCalendar events.
-    Each iCalendar event will have the summary "Möglicher Termin" and dtstart and dtend 
+    Each iCalendar event will have the given summary and dtstart and dtend 
     will be set to the start and end of each timespan respectively.
     """    
     # Create an empty list to store the iCalendar events
@@ -59,7 +86,7 @@ def create_ical_events_from_timespans(free_times):
         # Create a new iCalendar event
         ical_event = icaltools.new_event()
         # Set the summary of the event
-        ical_event.add('summary', 'Möglicher Conan Termin')
+        ical_event.add('summary', summary)
         # Set the start time of the event
         ical_event.add('dtstart', vDatetime(start))
         # Set the end time of the event
@@ -92,27 +119,6 @@ def find_free_times_new(events, period_start, period_end):
     # Return the list of free times
     return free_times
 
-def find_free_times(events, start_time, end_time):
-    # sort the events by their start time
-    events = sorted(events, key=lambda event: event['DTSTART'].dt)
-    # Create an empty list to store the free times
-    free_times = []
-    current_time = start_time
-    # Iterate over events
-    for event in events:
-        #parse dtstart and dtend to datetime objects
-        event_start = event.get('dtstart').dt
-        event_end = event.get('dtend').dt
-        if event_start < end_time:
-            if current_time < event_start:
-                free_times.append((current_time, event_start))
-            if current_time < event_end:
-                current_time = event_end
-    if current_time < end_time:
-        free_times.append((current_time, end_time))
-    # Return the list of free times
-    return free_times
-
 def define_timezone_for_event(event, timezone='Europe/Berlin'):
     dtstart = event["DTSTART"].dt
     dtend = event["DTEND"].end
@@ -165,100 +171,76 @@ def get_two_months_boundaries(now, timezone='Europe/Berlin'):
     return start_of_period, end_of_period
 
 
-def generate_joint_calendar(ical_links, calendar_name, filename):
-    timezone = pytz.timezone("Europe/Berlin")
-
-    start_of_period, end_of_period = get_two_months_boundaries(now = datetime.datetime.now(timezone))
-
-    # fetch and parse events from each link
-    events = []
-    vtimezones = []
+# occurrences that end this long before the period are kept in the event store when the period slides forward
+RETENTION = timedelta(weeks=10)
 
-    for link in ical_links:
-        try:
-            response = requests.get(link)
-            cal = icalendar.Calendar.from_ical(response.text)
-        except:
-            applog.error("Could not parse calendar: " +  link)
-            continue
-
-        try:
-            calendar_color = cal["X-APPLE-CALENDAR-COLOR"]
-        except:
-            try:
-                calendar_color = cal["X-COLOR"]
-            except:
-                calendar_color = "#9999ff"
-
-        # start with recurring events
+def update_source(connection, link, feed, start, end, deadline=None):
+    """
+    This function updates the occurrences of a fetched source in the event store.
+    A source whose feed did not change and whose stored window covers the period is not parsed at all,
+    a window that only slid forward is extended by the newly uncovered days.
+    Parsing and expanding runs in a worker process.
+
+    :param connection: A connection returned by eventstore.connect
+    :param link: The http(s) link of the source
+    :param feed: The fetcher.Feed of the link
+    :param start: A timezone-aware datetime object representing the start of the period
+    :param end: A timezone-aware datetime object representing the end of the period
+    :param deadline: The time.monotonic() value until which parsing has to finish or None
+    :return: The eventstore.Source or None if the source could not be parsed
+    """
+    start_time, end_time = int(start.timestamp()), int(end.timestamp())
+    source_id = get_source_id(link)
+    source = eventstore.get_source(connection, source_id)
+    unchanged = source is not None and source.content_key == feed.digest
+    if unchanged and source.window_start <= start_time and end_time <= source.window_end:
+        return source
+
+    # the period slid forward, only expand the new days
+    extend = unchanged and source.window_start <= start_time <= source.window_end
+    expansion_start = datetime.datetime.fromtimestamp(source.window_end, start.tzinfo) if extend else start
+    future = None
+    try:
+        future = expansion.submit(feed.body, expansion_start, end, source.window_end if extend else None)
         try:
-            other_calendar_name = cal["X-WR-CALNAME"]
-        except:
-            other_calendar_name = "Unnamed Calendar"
-        calendar_events = recurring_ical_events.of(cal, components=["VEVENT"]).between(start_of_period, end_of_period)
-        calendar_events = [icaltools.prepend_description(event, other_calendar_name) for event in calendar_events]
-        calendar_events = [icaltools.prepend_category(event, other_calendar_name) for event in calendar_events]
-        calendar_events = [icaltools.add_property(event, "COLOR", calendar_color) for event in calendar_events]
-        events += calendar_events
-        vtimezones += [c for c in cal.subcomponents if c.name == 'VTIMEZONE']
-
-    new_calendar = generate_new_icalendar(calendar_name, vtimezones, events)
-    #events = icaltools.localize_aware_events(events)
-    export_calendar(filename + ".ics", new_calendar)
-    export_calendar_as_json(filename + ".json", events)
-
-
-def generate_free_time_calendar(ical_links):
-    # specify the week of interest
-
-    timezone = pytz.timezone("Europe/Berlin")
-    now = datetime.datetime.now(timezone)
-    week_of_interest = now.isocalendar()[:2]
-
-    start_of_period, end_of_period = get_two_week_boundaries(week_of_interest)
-    # Set the time to midnight (hour, minute, second, microsecond)
-    midnight = timezone.localize(datetime.datetime.combine(now.date(), dttime.min))
+            name, color, vtimezones, records, masters, timings = future.result(None if deadline is None else max(deadline - time.monotonic(), 0))
+        except concurrent.futures.CancelledError:
+            # the pool was replaced before the expansion started, see expansion.abandon
+            future = expansion.submit(feed.body, expansion_start, end, source.window_end if extend else None)
+            name, color, vtimezones, records, masters, timings = future.result(None if deadline is None else max(deadline - time.monotonic(), 0))
+    except concurrent.futures.TimeoutError:
+        applog.error("Could not parse calendar before the deadline: " + link, source=source_id)
+        metrics.inc("failures_total", stage="timeout", source=source_id)
+        # a worker that hangs would block every later expansion
+        expansion.abandon(future)
+        return None
+    except concurrent.futures.process.BrokenProcessPool:
+        # the next submit replaces the broken pool
+        applog.error("Could not parse calendar, a worker process died: " + link, source=source_id)
+        metrics.inc("failures_total", stage="worker", source=source_id)
+        return None
+    except:
+        applog.error("Could not parse calendar: " +  link, source=source_id)
+        metrics.inc("failures_total", stage="parse", source=source_id)
+        return None
+    for stage, seconds in timings.items():
+        metrics.observe("stage_duration_seconds", seconds, stage=stage, source=source_id)
+    metrics.inc("expanded_occurrences_total", len(records), source=source_id)
+    if extend:
+        eventstore.extend_source(connection, source_id, max(source.window_start, int((start - RETENTION).timestamp())), end_time, records, masters)
+    else:
+        eventstore.replace_source(connection, source_id, name, color, feed.digest, vtimezones, start_time, end_time, records, masters)
+    return eventstore.get_source(connection, source_id)
 
-    start_of_period = midnight
 
-    # fetch and parse events from each link
-    events = []
-    vtimezones = []
+def parse_vtimezones(vtimezones):
+    """
+    Returns the VTIMEZONE components of a source (see eventstore.Source) as list of icalendar.Timezone objects.
+    """
+    if not vtimezones:
+        return []
+    return icalendar.Calendar.from_ical("BEGIN:VCALENDAR\r\n" + vtimezones + "END:VCALENDAR\r\n").subcomponents
 
-    for link in ical_links:
-        try:
-            response = requests.get(link)
-            cal = icalendar.Calendar.from_ical(response.text)
-        except:
-            applog.error("Could not parse calendar: " +  link)
-            continue
-        # start with recurring events
-        events += recurring_ical_events.of(cal, components=["VEVENT"]).between(start_of_period, end_of_period)
-        vtimezones += [c for c in cal.subcomponents if c.name == 'VTIMEZONE']
-        for component in cal.walk():
-            if component.name == "VEVENT" and not 'RRULE' in component and not icaltools.is_fullday_event(component):
-                component = icaltools.make_event_timezone_aware(component, "UTC")
-                start = component.get('dtstart').dt
-                end = component.get('dtend').dt
-                if start_of_period <= end <= end_of_period or start_of_period <= start <= end_of_period or (start < start_of_period and end > end_of_period):
-                    events.append(component)
-
-    # retrieve conan events
-    conan_events = icaltools.filter_by_summary_keyword(events, "Conan")
-    # ignore recurring full day events
-    events = icaltools.exclude_fullday_events(events)
-    # include events for sleep time
-    events += generate_sleep_events(start_of_period, end_of_period)
-    events = icaltools.localize_aware_events(events)
-    export_calendar("invert-conan-calendar.ics", generate_new_icalendar("Invertierte Freizeit", vtimezones, events))
-    # generate events inbetween the free times
-    events = invert_events(events, start_of_period, end_of_period)
-    # ignore all free time events with a mininmal duration
-    events = icaltools.filter_by_duration(events,timedelta(minutes=150))
-    # add conan events to the free time events
-    events += conan_events
-
-    return generate_new_icalendar('Detektiv Conan Freizeit', vtimezones, events)
 
 def generate_new_icalendar(name, vtimezones, events):
     new_calendar = icalendar.Calendar()
@@ -289,18 +271,14 @@ def parse_file(filepath):
     links = [link.replace("webcal", "https") if link.startswith("webcal") else link for link in links]
     return links
 
-def write_ludwig_calendar():
-    calendar_links = parse_file("ludwig_links.txt")
-    generate_joint_calendar(calendar_links, "Ludwigs kombinierter Kalender", "ludwigskombilender")
-
-def write_calendar():
-    calendar_links = parse_file("links.txt")
-    with open("conan-calendar.ics", 'wb') as f:
-        f.write(generate_free_time_calendar(calendar_links).to_ical())
+def get_source_id(link):
+    """
+    Returns a short identifier for a calendar link that does not reveal the (secret) link itself.
+    """
+    return hashlib.sha1(link.encode("utf-8")).hexdigest()[:8]
 
 def export_calendar(filename, icalendar):
-    with open(filename, 'wb') as f:
-        f.write(icalendar.to_ical())
+    publish.publish(filename, icalendar.to_ical())
 
 def export_calendar_as_json(filename, ical_events):
     events = []
@@ -311,7 +289,29 @@ def export_calendar_as_json(filename, ical_events):
         event["start"] = str(ical_event.get('dtstart').dt)
         event["end"] = str(ical_event.get('dtend').dt)
         event["color"] = ical_event.get("COLOR")
+        event["categories"] = str(ical_event.get("CATEGORIES", ""))
         events.append(event)
 
-    with open(filename, 'w') as f:
-        f.write(json.dumps(events))
\ No newline at end of file
+    publish.publish(filename, json.dumps(events))
+
+def export_busy_times(filename, busy_times_by_source, sleep_times, start, end):
+    """
+    This function publishes the merged busy times of every source and of all sources together, so that the
+    web app can answer availability and free time queries without generating a calendar.
+
+    :param filename: The path of the json file
+    :param busy_times_by_source: A list of (source id, source name, interval set) tuples
+    :param sleep_times: An interval set with the sleep times that apply to everybody
+    :param start: A timezone-aware datetime object representing the start of the period
+    :param end: A timezone-aware datetime object representing the end of the period
+    """
+    busy_times = {
+        "start": int(start.timestamp()),
+        "end": int(end.timestamp()),
+        "sources": [{"id": source_id, "name": name, "starts": list(busy[0]), "ends": list(busy[1])}
+                    for source_id, name, busy in busy_times_by_source],
+        "sleep": {"starts": list(sleep_times[0]), "ends": list(sleep_times[1])}
+    }
+    merged = intervals.union(sleep_times, *[busy for _, _, busy in busy_times_by_source])
+    busy_times["merged"] = {"starts": list(merged[0]), "ends": list(merged[1])}
+    publish.publish(filename, json.dumps(busy_times))
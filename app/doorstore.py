@@ -0,0 +1,83 @@
+import sqlite3
+
+# database with all intervals in which the maschinenraum was open
+DATABASE = "mrkalender.db"
+
+
+def connect(path=DATABASE):
+    """
+    Opens the door status store and creates the table and its unique index if they do not exist yet.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS openings ("
+                       "start_time INTEGER NOT NULL, "
+                       "end_time INTEGER NOT NULL, "
+                       "summary TEXT NOT NULL, "
+                       "vevent TEXT NOT NULL)")
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS openings_interval ON openings (start_time, end_time, summary)")
+    # progress of the ingestion of every feed: the newest processed item and the start of an interval that is still open
+    connection.execute("CREATE TABLE IF NOT EXISTS ingestion ("
+                       "feed TEXT PRIMARY KEY, "
+                       "last_published INTEGER, "
+                       "open_since INTEGER)")
+    # ids of the items that were published in the same second as the newest processed item of every feed
+    connection.execute("CREATE TABLE IF NOT EXISTS processed_items ("
+                       "feed TEXT NOT NULL, "
+                       "item TEXT NOT NULL, "
+                       "PRIMARY KEY (feed, item))")
+    connection.commit()
+    return connection
+
+
+def is_empty(connection):
+    return connection.execute("SELECT 1 FROM openings LIMIT 1").fetchone() is None
+
+
+def add_events(connection, events):
+    """
+    This function stores events in the door status store. Events with the same start time, end time and summary
+    as a stored event are ignored, so the work only depends on the number of new events.
+    The serialised event is stored as well, so exporting never has to serialise an event again.
+
+    :param connection: A connection returned by connect
+    :param events: A list of icalendar.Event objects with timezone-aware DTSTART and DTEND
+    :return: The number of events that were added
+    """
+    changes = connection.total_changes
+    connection.executemany("INSERT OR IGNORE INTO openings (start_time, end_time, summary, vevent) VALUES (?, ?, ?, ?)",
+                           [(int(event['DTSTART'].dt.timestamp()), int(event['DTEND'].dt.timestamp()),
+                             str(event['SUMMARY']), event.to_ical().decode("utf-8")) for event in events])
+    connection.commit()
+    return connection.total_changes - changes
+
+
+def get_serialised_events(connection):
+    """
+    Returns the serialised VEVENT components of all stored events sorted by their start time.
+    """
+    return [row[0] for row in connection.execute("SELECT vevent FROM openings ORDER BY start_time")]
+
+
+def get_ingestion_state(connection, feed):
+    """
+    Returns the publication time of the newest processed item of a feed and the start of the interval that is
+    still open (both epoch seconds), or None for values that are unknown.
+    """
+    row = connection.execute("SELECT last_published, open_since FROM ingestion WHERE feed = ?", (feed,)).fetchone()
+    return row if row else (None, None)
+
+
+def get_processed_items(connection, feed):
+    """
+    Returns the ids of the processed items of a feed that were published in the second of the newest one.
+    """
+    return set(row[0] for row in connection.execute("SELECT item FROM processed_items WHERE feed = ?", (feed,)))
+
+
+def set_ingestion_state(connection, feed, last_published, open_since, processed_items=()):
+    connection.execute("INSERT OR REPLACE INTO ingestion (feed, last_published, open_since) VALUES (?, ?, ?)",
+                       (feed, last_published, open_since))
+    connection.execute("DELETE FROM processed_items WHERE feed = ?", (feed,))
+    connection.executemany("INSERT INTO processed_items (feed, item) VALUES (?, ?)",
+                           [(feed, item) for item in processed_items])
+    connection.commit()
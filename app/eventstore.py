@@ -0,0 +1,247 @@
+import datetime
+import sqlite3
+from collections import Counter, namedtuple
+
+import icalendar
+
+# database with the expanded occurrences of all source calendars
+DATABASE = "events.db"
+
+# a source calendar, the window is the span (epoch seconds) for which its occurrences are stored
+Source = namedtuple("Source", ["source", "name", "color", "content_key", "vtimezones", "window_start", "window_end"])
+# a single occurrence of an event, start_time and end_time are epoch seconds. The occurrences of a recurring event
+# share the serialised master, their vevent only holds their DTSTART and DTEND (see get_vevent)
+Occurrence = namedtuple("Occurrence", ["source", "uid", "start_time", "end_time", "fullday", "summary", "vevent", "master"])
+
+VEVENT_BEGIN = "BEGIN:VEVENT\r\n"
+VEVENT_END = "END:VEVENT\r\n"
+
+
+def connect(path=DATABASE):
+    """
+    Opens the event store and creates the tables and indices if they do not exist yet.
+    """
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("CREATE TABLE IF NOT EXISTS sources ("
+                       "source TEXT PRIMARY KEY, "
+                       "name TEXT NOT NULL, "
+                       "color TEXT, "
+                       "content_key TEXT NOT NULL, "
+                       "vtimezones TEXT NOT NULL, "
+                       "window_start INTEGER NOT NULL, "
+                       "window_end INTEGER NOT NULL)")
+    connection.execute("CREATE TABLE IF NOT EXISTS occurrences ("
+                       "source TEXT NOT NULL, "
+                       "uid TEXT NOT NULL, "
+                       "recurrence TEXT NOT NULL, "
+                       "start_time INTEGER NOT NULL, "
+                       "end_time INTEGER NOT NULL, "
+                       "fullday INTEGER NOT NULL, "
+                       "summary TEXT NOT NULL, "
+                       "vevent TEXT NOT NULL, "
+                       "override INTEGER NOT NULL DEFAULT 0, "
+                       "master INTEGER NOT NULL DEFAULT 0)")
+    # stores created before overrides were marked or masters were shared
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(occurrences)")]
+    for column in ["override", "master"]:
+        if column not in columns:
+            connection.execute("ALTER TABLE occurrences ADD COLUMN " + column + " INTEGER NOT NULL DEFAULT 0")
+    # the serialised master of every recurring event without DTSTART and DTEND, stored once for all of its occurrences
+    connection.execute("CREATE TABLE IF NOT EXISTS masters ("
+                       "source TEXT NOT NULL, "
+                       "uid TEXT NOT NULL, "
+                       "vevent TEXT NOT NULL, "
+                       "PRIMARY KEY (source, uid))")
+    connection.execute("CREATE INDEX IF NOT EXISTS occurrences_time ON occurrences (source, start_time, end_time)")
+    # the same occurrence is expanded twice if it overlaps the border of two expanded windows
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS occurrences_identity ON occurrences (source, uid, recurrence)")
+    connection.commit()
+    return connection
+
+
+def to_timestamp(value):
+    """
+    Returns the epoch seconds of a date or datetime. Dates and floating times are interpreted as UTC.
+    """
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+    if not value.tzinfo:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+
+def get_recurring_uids(calendar):
+    """
+    Returns the UIDs of the recurring events of an icalendar.Calendar whose occurrences can share their master,
+    UIDs that several events without RECURRENCE-ID use are left out.
+    """
+    masters = [component for component in calendar.walk('VEVENT') if 'RECURRENCE-ID' not in component]
+    counts = Counter(str(component.get('UID', '')) for component in masters)
+    return set(str(component.get('UID', '')) for component in masters
+               if ('RRULE' in component or 'RDATE' in component) and counts[str(component.get('UID', ''))] == 1)
+
+
+def get_dates(event):
+    """
+    Returns the serialised DTSTART and DTEND lines of an occurrence, the only lines in which the occurrences
+    of a recurring event differ.
+    """
+    dates = icalendar.Event()
+    for name in ['DTSTART', 'DTEND']:
+        if name in event:
+            dates[name] = event[name]
+    return dates.to_ical().decode("utf-8")[len(VEVENT_BEGIN):-len(VEVENT_END)]
+
+
+def get_master(event):
+    """
+    Returns the serialised occurrence of a recurring event without DTSTART and DTEND, see get_dates.
+    """
+    # Event.copy would drop the subcomponents, e.g. alarms
+    master = icalendar.Event()
+    for name, value in event.items():
+        if name not in ['DTSTART', 'DTEND']:
+            master[name] = value
+    master.subcomponents = event.subcomponents
+    return master.to_ical().decode("utf-8")
+
+
+def get_vevent(occurrence):
+    """
+    Returns the serialised VEVENT of an Occurrence, occurrences of a recurring event are only joined with
+    their master when they are exported.
+    """
+    if occurrence.master is None:
+        return occurrence.vevent
+    return VEVENT_BEGIN + occurrence.vevent + occurrence.master[len(VEVENT_BEGIN):]
+
+
+def to_record(event, master=False):
+    """
+    Returns the normalised occurrence record of an icalendar.Event:
+    (uid, recurrence, start time, end time, full day, summary, serialised event, override, master).
+    With master only the DTSTART and DTEND of the event are serialised, the rest is stored once as its master.
+    Records only contain plain values, so they can be sent between processes.
+    """
+    dtstart = event['DTSTART'].dt
+    dtend = event['DTEND'].dt if 'DTEND' in event else dtstart
+    recurrence = event.get('RECURRENCE-ID', event['DTSTART']).dt
+    fullday = not isinstance(dtstart, datetime.datetime)
+    return (str(event.get('UID', '')), str(recurrence), to_timestamp(dtstart), to_timestamp(dtend),
+            int(fullday), str(event.get('SUMMARY', '')), get_dates(event) if master else event.to_ical().decode("utf-8"),
+            int('RECURRENCE-ID' in event), int(master))
+
+
+def to_records(events, stored_end=None, recurring_uids=()):
+    """
+    Returns the occurrence records (see to_record) of a list of icalendar.Event objects in a single pass.
+    Serialising is the expensive part, so duplicate occurrences and timed occurrences that start before
+    stored_end, which overlap the stored window and are stored already, are dropped before, and a recurring
+    event is serialised once as master instead of once per occurrence.
+    recurring_ical_events returns an occurrence twice if it does not recognise the RECURRENCE-ID of its
+    override, e.g. in another timezone, of two occurrences with the same identity the override is kept.
+
+    :param events: A list of icalendar.Event objects
+    :param stored_end: Epoch seconds of the end of the stored window or None
+    :param recurring_uids: The UIDs of the events whose occurrences share their master, see get_recurring_uids
+    :return: A list of occurrence records and a dictionary with the serialised master of every recurring event by UID
+    """
+    unique_events = {}
+    for event in events:
+        identity = (str(event.get('UID', '')), str(event.get('RECURRENCE-ID', event['DTSTART']).dt))
+        if identity not in unique_events or 'RECURRENCE-ID' in event and 'RECURRENCE-ID' not in unique_events[identity]:
+            unique_events[identity] = event
+    records = []
+    masters = {}
+    for (uid, _), event in unique_events.items():
+        dtstart = event['DTSTART'].dt
+        # full day and floating occurrences are stored in utc, they are left to the unique index
+        if stored_end is not None and isinstance(dtstart, datetime.datetime) and dtstart.tzinfo and dtstart.timestamp() < stored_end:
+            continue
+        # overrides differ from their master in more than their dates
+        master = uid in recurring_uids and 'RECURRENCE-ID' not in event
+        if master and uid not in masters:
+            masters[uid] = get_master(event)
+        records.append(to_record(event, master))
+    return records, masters
+
+
+# an override replaces an occurrence that was stored before, e.g. while its override was outside the window
+INSERT_OCCURRENCE = ("INSERT INTO occurrences VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                     "ON CONFLICT (source, uid, recurrence) DO UPDATE SET start_time = excluded.start_time, "
+                     "end_time = excluded.end_time, fullday = excluded.fullday, summary = excluded.summary, "
+                     "vevent = excluded.vevent, override = excluded.override, master = excluded.master "
+                     "WHERE excluded.override > occurrences.override")
+
+
+def get_source(connection, source):
+    row = connection.execute("SELECT source, name, color, content_key, vtimezones, window_start, window_end "
+                             "FROM sources WHERE source = ?", (source,)).fetchone()
+    return Source(*row) if row else None
+
+
+def replace_source(connection, source, name, color, content_key, vtimezones, window_start, window_end, records, masters=None):
+    """
+    This function replaces all stored occurrences of a source.
+
+    :param connection: A connection returned by connect
+    :param source: The id of the source
+    :param name: The name of the source calendar
+    :param color: The color of the source calendar
+    :param content_key: A key that changes whenever the source calendar changes, e.g. the digest of the feed
+    :param vtimezones: The serialised VTIMEZONE components of the source calendar
+    :param window_start: Epoch seconds of the start of the expanded window
+    :param window_end: Epoch seconds of the end of the expanded window
+    :param records: A list of occurrence records (see to_record) with all occurrences in the window
+    :param masters: A dictionary with the serialised masters of the records by UID, see to_records
+    """
+    with connection:
+        connection.execute("DELETE FROM occurrences WHERE source = ?", (source,))
+        connection.execute("DELETE FROM masters WHERE source = ?", (source,))
+        connection.executemany("INSERT INTO masters VALUES (?, ?, ?)", [(source, uid, vevent) for uid, vevent in (masters or {}).items()])
+        connection.executemany(INSERT_OCCURRENCE, [(source,) + record for record in records])
+        connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (source, name, color, content_key, vtimezones, window_start, window_end))
+
+
+def extend_source(connection, source, window_start, window_end, records, masters=None):
+    """
+    This function adds the occurrences of a window that slid forward. Occurrences that end before the new
+    window start are removed.
+
+    :param connection: A connection returned by connect
+    :param source: The id of the source
+    :param window_start: Epoch seconds of the new start of the window
+    :param window_end: Epoch seconds of the new end of the window
+    :param records: A list of occurrence records (see to_record) with the occurrences in the newly uncovered days
+    :param masters: A dictionary with the serialised masters of the records by UID, see to_records
+    """
+    with connection:
+        connection.execute("DELETE FROM occurrences WHERE source = ? AND end_time < ?", (source, window_start))
+        connection.executemany(INSERT_OCCURRENCE, [(source,) + record for record in records])
+        # the source did not change, so the masters of the stored occurrences stay the same
+        connection.executemany("INSERT OR REPLACE INTO masters VALUES (?, ?, ?)", [(source, uid, vevent) for uid, vevent in (masters or {}).items()])
+        connection.execute("DELETE FROM masters WHERE source = ? AND uid NOT IN "
+                           "(SELECT uid FROM occurrences WHERE source = ? AND master = 1)", (source, source))
+        connection.execute("UPDATE sources SET window_start = ?, window_end = ? WHERE source = ?",
+                           (window_start, window_end, source))
+
+
+def get_occurrences(connection, sources, start, end):
+    """
+    Returns all stored occurrences of the sources that overlap the span between start and end, sorted by their start.
+
+    :param connection: A connection returned by connect
+    :param sources: A list of source ids
+    :param start: Epoch seconds of the start of the span
+    :param end: Epoch seconds of the end of the span
+    :return: A list of Occurrence objects, the occurrences of a recurring event share its master
+    """
+    occurrences = []
+    for source in sources:
+        masters = dict(connection.execute("SELECT uid, vevent FROM masters WHERE source = ?", (source,)))
+        occurrences += [Occurrence(*row[:-1], masters.get(row[1]) if row[-1] else None) for row in connection.execute(
+            "SELECT source, uid, start_time, end_time, fullday, summary, vevent, master FROM occurrences "
+            "WHERE source = ? AND start_time < ? AND (end_time > ? OR start_time >= ?)",
+            (source, end, start, start))]
+    return sorted(occurrences, key=lambda occurrence: occurrence.start_time)
@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import recurring_ical_events
+
+import icsparse
+import eventstore
+
+# number of worker processes that parse and expand calendars
+MAX_PROCESSES = os.cpu_count() or 1
+
+executor = None
+executor_lock = threading.Lock()
+# unfinished expansions by pool and the expansions that were given up by pool, a pool that was replaced
+# because of a hanging expansion is terminated once only given up expansions are left in it
+running = {}
+abandoned = {}
+
+
+def get_executor():
+    # the pool is created once and reused in every cycle. It is created by a worker thread while the log
+    # listener and other threads are running, forking would copy locks that are held by these threads into
+    # the worker processes, so the workers are started by a fork server instead
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=MAX_PROCESSES, mp_context=multiprocessing.get_context("forkserver"))
+        return executor
+
+
+def expand_feed(body, start, end, stored_end=None):
+    """
+    This function runs in a worker process. It parses the events of a feed that can overlap the window between
+    start and end and expands all of their occurrences in the window.
+    Only plain values are returned, so nothing but compact records has to be sent back to the main process.
+
+    :param body: The content of the ics file
+    :param start: A timezone-aware datetime object representing the start of the window
+    :param end: A timezone-aware datetime object representing the end of the window
+    :param stored_end: Epoch seconds of the end of the window whose occurrences are stored already or None
+    :return: A tuple of the calendar name, the calendar color, the serialised VTIMEZONE components,
+             a list of occurrence records (see eventstore.to_record), the serialised masters of the recurring
+             events (see eventstore.to_records) and a dictionary with the seconds
+             spent in every stage, the metrics of the worker process are not visible to the main process
+    """
+    timings = {}
+    start_time = time.perf_counter()
+    cal = icsparse.parse_calendar_between(body, start, end)
+    timings["parse"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    occurrences = recurring_ical_events.of(cal, components=["VEVENT"]).between(start, end)
+    timings["expand"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    records, masters = eventstore.to_records(occurrences, stored_end, eventstore.get_recurring_uids(cal))
+    timings["tz_normalise"] = time.perf_counter() - start_time
+
+    name = str(cal.get("X-WR-CALNAME", ""))
+    color = str(cal.get("X-APPLE-CALENDAR-COLOR", cal.get("X-COLOR", "#9999ff")))
+    vtimezones = "".join(c.to_ical().decode("utf-8") for c in cal.subcomponents if c.name == 'VTIMEZONE')
+    return name, color, vtimezones, records, masters, timings
+
+
+def terminate(pool):
+    """
+    Terminates the worker processes of a pool, the expansions that are still running in it fail.
+    The pool notices that its workers are gone and stops by itself, on Python 3.8 calling shutdown as well
+    can crash its management thread before it failed the futures.
+    """
+    with executor_lock:
+        running.pop(pool, None)
+        abandoned.pop(pool, None)
+    # ProcessPoolExecutor has no public way to stop workers that are busy
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+
+
+def is_finished(pool):
+    # only called with the lock held
+    return pool in abandoned and running.get(pool, set()) <= abandoned[pool]
+
+
+def finish(pool, future):
+    with executor_lock:
+        running.get(pool, set()).discard(future)
+        finished = is_finished(pool)
+    if finished:
+        terminate(pool)
+
+
+def abandon(future):
+    """
+    Gives up an expansion that did not finish before its deadline. Its worker can hang forever, so new expansions
+    are sent to a new pool. Expansions that did not start yet in the old pool are cancelled, so that they can be
+    submitted again, the old pool is terminated as soon as all of its other expansions finished.
+    """
+    global executor
+    with executor_lock:
+        pool = next((pool for pool, futures in running.items() if future in futures), None)
+        if pool is None:
+            return
+        abandoned.setdefault(pool, set()).add(future)
+        if pool is executor:
+            executor = None
+        pending = list(running[pool])
+    # cancelling runs the done callbacks, which take the lock
+    for other in pending:
+        other.cancel()
+    with executor_lock:
+        finished = is_finished(pool)
+    if finished:
+        terminate(pool)
+
+
+def discard(pool):
+    """
+    Replaces a pool whose worker died (e.g. killed for lack of memory), such a pool cannot run anything anymore.
+    """
+    global executor
+    with executor_lock:
+        if pool is executor:
+            executor = None
+    terminate(pool)
+
+
+def submit_function(function, *args):
+    """
+    Runs the function in a worker process, a broken pool is replaced by a new one.
+
+    :return: A concurrent.futures.Future
+    """
+    pool = get_executor()
+    try:
+        future = pool.submit(function, *args)
+    except BrokenProcessPool:
+        discard(pool)
+        pool = get_executor()
+        future = pool.submit(function, *args)
+    with executor_lock:
+        running.setdefault(pool, set()).add(future)
+    future.add_done_callback(lambda future: finish(pool, future))
+    return future
+
+
+def submit(body, start, end, stored_end=None):
+    """
+    Sends a feed to a worker process, see expand_feed.
+
+    :return: A concurrent.futures.Future
+    """
+    return submit_function(expand_feed, body, start, end, stored_end)
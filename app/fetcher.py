@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import applog
+import metrics
+
+# number of calendars that are downloaded at the same time
+MAX_WORKERS = 8
+# number of simultaneous connections to a single host
+MAX_PER_HOST = 4
+# seconds to wait for a server to connect and to send data
+TIMEOUT = 30
+# directory with the raw bodies and validators of all fetched feeds
+CACHE_DIR = "cache/feeds"
+
+# body of a fetched feed together with the sha1 digest of the body, a changed feed is recognised by its digest
+Feed = namedtuple("Feed", ["url", "body", "digest"])
+
+# one session for all fetches so that keep-alive connections are reused between cycles
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+session.mount("http://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+host_limits = {}
+host_limits_lock = threading.Lock()
+
+
+def get_host_limit(url):
+    """
+    Returns the semaphore that limits the number of parallel requests to the host of the url.
+    """
+    host = urlparse(url).netloc
+    with host_limits_lock:
+        if host not in host_limits:
+            host_limits[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return host_limits[host]
+
+
+def get_cache_path(url, extension):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, key + extension)
+
+
+def write_cache_file(path, content):
+    # write to a temporary file first so that a crash never leaves a half written cache entry
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = path + "." + str(threading.get_ident()) + ".tmp"
+    with open(temp_path, 'w', encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def load_validators(url):
+    """
+    Returns the stored validators (etag, last modified date and digest) of a url or an empty dictionary.
+    """
+    try:
+        with open(get_cache_path(url, ".json"), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_validators(url, validators):
+    validators = dict(validators, url=url)
+    write_cache_file(get_cache_path(url, ".json"), json.dumps(validators))
+
+
+def load_cached_body(url):
+    try:
+        with open(get_cache_path(url, ".ics"), 'r', encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def fetch(url):
+    """
+    This function downloads a single calendar. If the calendar was downloaded before, the request is conditional
+    (If-None-Match / If-Modified-Since) and an unchanged calendar is read from the on-disk cache instead.
+
+    :param url: A string with the http(s) link of the calendar
+    :return: A Feed or None if the download failed
+    """
+    validators = load_validators(url)
+    cached_body = load_cached_body(url) if validators else None
+    headers = {}
+    if cached_body is not None:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    # the same short id as conanbot.get_source_id, the link itself can be secret
+    source = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+    with get_host_limit(url):
+        start = time.perf_counter()
+        try:
+            response = session.get(url, headers=headers, timeout=TIMEOUT)
+            metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage="fetch", source=source)
+            metrics.inc("fetch_responses_total", source=source, status=str(response.status_code))
+            if response.status_code == 304 and cached_body is not None:
+                return Feed(url, cached_body, validators["digest"])
+            response.raise_for_status()
+        except requests.RequestException:
+            applog.error("Could not fetch calendar: " + url, source=source)
+            metrics.inc("failures_total", stage="fetch", source=source)
+            return None
+    metrics.inc("fetch_bytes_total", len(response.content), source=source)
+
+    body = response.text
+    digest = hashlib.sha1(body.encode("utf-8")).hexdigest()
+    if digest != validators.get("digest"):
+        write_cache_file(get_cache_path(url, ".ics"), body)
+    save_validators(url, {"etag": response.headers.get("ETag"),
+                          "last_modified": response.headers.get("Last-Modified"),
+                          "digest": digest})
+    return Feed(url, body, digest)
+
+
+def fetch_all(urls):
+    """
+    This function downloads all calendars at the same time, so that a cycle takes about as long as
+    the slowest calendar instead of the sum of all of them.
+
+    :param urls: A list of http(s) links
+    :return: A dictionary that maps every link to its Feed or to None if the download failed
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(urls))) as executor:
+        feeds = list(executor.map(fetch, urls))
+    return dict(zip(urls, feeds))
@@ -272,6 +272,8 @@ Recurring Events Management
 
 """
 
+# create_events_from_recurring_event and create_non_recurring_events are not used by the calendar pipeline,
+# occurrences are expanded by recurring_ical_events in a worker process (see expansion.py)
 def create_events_from_recurring_event(recurring_event, start, end):
     if not is_fullday_event(recurring_event):
         rrule_str = recurring_event.get('RRULE').to_ical().decode("utf-8").strip()
@@ -303,18 +305,3 @@ def create_non_recurring_events(recurring_event, occurrences, timezone='UTC'):
         non_recurring_events.append(non_recurring_event)
     # Return the list of non-recurring events
     return non_recurring_events
-
-# unite events_a and events_b so that multiple events with the same start time, end time and summary are not duplicated
-def unite_events(events_a, events_b):
-    events_a = sorted(events_a, key=lambda x: (x['DTSTART'].dt))
-    events_b = sorted(events_b, key=lambda x: (x['DTSTART'].dt))
-    for event in events_b:
-        is_duplicate = False
-        for event_a in events_a:
-            if event_a['DTSTART'].dt == event['DTSTART'].dt and event_a['DTEND'].dt == event['DTEND'].dt and event_a['SUMMARY'] == event['SUMMARY']:
-                is_duplicate = True
-                break
-        if not is_duplicate:
-            events_a.append(event)
-    return events_a
-        
\ No newline at end of file
@@ -0,0 +1,128 @@
+import datetime
+
+import icalendar
+
+# days added on both sides of the window, covers all utc offsets and floating times
+MARGIN = datetime.timedelta(days=2)
+
+
+def unfold_lines(text):
+    """
+    Yields the content lines of an ics file one by one with folded lines joined.
+    """
+    line = None
+    for raw_line in text.splitlines():
+        if raw_line[:1] in (" ", "\t") and line is not None:
+            line += raw_line[1:]
+            continue
+        if line:
+            yield line
+        line = raw_line
+    if line:
+        yield line
+
+
+def get_name(line):
+    end = len(line)
+    for separator in (";", ":"):
+        index = line.find(separator)
+        if index != -1 and index < end:
+            end = index
+    return line[:end].upper()
+
+
+def get_day(line):
+    # values of DTSTART, DTEND and RECURRENCE-ID never contain a colon, the day are the first 8 digits: YYYYMMDD
+    return line.rsplit(":", 1)[-1].strip()[:8]
+
+
+def get_end_day(properties):
+    if "DTEND" in properties:
+        return get_day(properties["DTEND"])
+    start_day = get_day(properties["DTSTART"])
+    if "DURATION" in properties:
+        try:
+            start = datetime.datetime.strptime(start_day, "%Y%m%d")
+            duration = icalendar.vDuration.from_ical(properties["DURATION"].rsplit(":", 1)[-1].strip())
+            return (start + duration + datetime.timedelta(days=1)).strftime("%Y%m%d")
+        except ValueError:
+            return None
+    return start_day
+
+
+def may_overlap(properties, first_day, last_day):
+    """
+    Checks cheaply on the raw properties of an event whether it can have an occurrence between first_day and last_day.
+    Days are compared as YYYYMMDD strings, events that cannot be checked are kept.
+    """
+    if "DTSTART" not in properties:
+        return True
+    start_day = get_day(properties["DTSTART"])
+    if not start_day.isdigit() or len(start_day) != 8:
+        return True
+    if start_day > last_day:
+        # an edited occurrence can move an occurrence from the window to the future
+        return "RECURRENCE-ID" in properties and first_day <= get_day(properties["RECURRENCE-ID"]) <= last_day
+    if "RRULE" in properties:
+        rule = properties["RRULE"].split(":", 1)[-1].upper()
+        for part in rule.split(";"):
+            if part.startswith("UNTIL="):
+                return part[6:14] >= first_day
+        return True
+    if "RDATE" in properties:
+        return True
+    if "RECURRENCE-ID" in properties and first_day <= get_day(properties["RECURRENCE-ID"]) <= last_day:
+        return True
+    end_day = get_end_day(properties)
+    return end_day is None or end_day >= first_day
+
+
+def parse_calendar_between(text, start, end):
+    """
+    This function parses an ics file but only constructs the events that can overlap the timespan between
+    start and end. The file is read line by line and every event is checked on its raw DTSTART, DTEND, DURATION,
+    RRULE and RECURRENCE-ID lines before it is handed to icalendar. Calendar properties and VTIMEZONE components
+    are always kept, other components are dropped.
+
+    :param text: The content of the ics file
+    :param start: A timezone-aware datetime object representing the start of the window
+    :param end: A timezone-aware datetime object representing the end of the window
+    :return: An icalendar.Calendar object
+    """
+    first_day = (start.astimezone(datetime.timezone.utc) - MARGIN).strftime("%Y%m%d")
+    last_day = (end.astimezone(datetime.timezone.utc) + MARGIN).strftime("%Y%m%d")
+
+    kept_lines = []
+    component_lines = None
+    component_name = None
+    properties = {}
+    depth = 0
+    for line in unfold_lines(text):
+        name = get_name(line)
+        value = line[len(name) + 1:].strip().upper() if name in ("BEGIN", "END") else None
+        if component_lines is None:
+            if name == "BEGIN" and value != "VCALENDAR":
+                component_lines = [line]
+                component_name = value
+                properties = {}
+                depth = 1
+            elif name != "END" or value == "VCALENDAR":
+                kept_lines.append(line)
+            continue
+
+        component_lines.append(line)
+        if name == "BEGIN":
+            depth += 1
+        elif name == "END":
+            depth -= 1
+            if depth == 0:
+                if component_name == "VTIMEZONE" or (component_name == "VEVENT" and may_overlap(properties, first_day, last_day)):
+                    kept_lines += component_lines
+                component_lines = None
+        elif depth == 1 and component_name == "VEVENT" and name not in properties:
+            properties[name] = line
+
+    # make sure the calendar is closed even if the file was cut off
+    if not kept_lines or get_name(kept_lines[-1]) != "END":
+        kept_lines.append("END:VCALENDAR")
+    return icalendar.Calendar.from_ical("\r\n".join(kept_lines))
@@ -0,0 +1,187 @@
+"""
+
+Interval sets
+
+An interval set is a tuple (starts, ends) of two arrays with epoch seconds. Interval sets returned by
+merge, union and complement are sorted by start and do not overlap.
+Events are only converted to interval sets at the input edge and back to datetimes at the output edge.
+
+"""
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+def empty():
+    return array('q'), array('q')
+
+
+def from_pairs(pairs):
+    """
+    Creates an interval set from (start, end) pairs of timezone-aware datetime objects or epoch seconds.
+    """
+    starts, ends = empty()
+    for start, end in pairs:
+        if isinstance(start, datetime.datetime):
+            start, end = start.timestamp(), end.timestamp()
+        starts.append(int(start))
+        ends.append(int(end))
+    return starts, ends
+
+
+def to_datetimes(intervals, tz):
+    """
+    Returns the intervals as list of (start, end) pairs of datetime objects in the timezone tz.
+    """
+    starts, ends = intervals
+    return [(datetime.datetime.fromtimestamp(start, tz), datetime.datetime.fromtimestamp(end, tz))
+            for start, end in zip(starts, ends)]
+
+
+def merge(intervals):
+    """
+    Sorts the intervals by their start and merges all intervals that overlap or touch.
+    """
+    merged_starts, merged_ends = empty()
+    for start, end in sorted(zip(*intervals)):
+        if merged_ends and start <= merged_ends[-1]:
+            if end > merged_ends[-1]:
+                merged_ends[-1] = end
+        else:
+            merged_starts.append(start)
+            merged_ends.append(end)
+    return merged_starts, merged_ends
+
+
+def union(*interval_sets):
+    """
+    Returns the merged union of several interval sets.
+    """
+    starts, ends = empty()
+    for interval_set in interval_sets:
+        starts.extend(interval_set[0])
+        ends.extend(interval_set[1])
+    return merge((starts, ends))
+
+
+def complement(intervals, period_start, period_end):
+    """
+    Returns the gaps between the merged intervals within the period between period_start and period_end.
+
+    :param intervals: A merged interval set
+    :param period_start: Epoch seconds of the start of the period
+    :param period_end: Epoch seconds of the end of the period
+    :return: A merged interval set
+    """
+    gap_starts, gap_ends = empty()
+    current = period_start
+    for start, end in zip(*intervals):
+        if start >= period_end:
+            break
+        if current < start:
+            gap_starts.append(current)
+            gap_ends.append(start)
+        if current < end:
+            current = end
+    if current < period_end:
+        gap_starts.append(current)
+        gap_ends.append(period_end)
+    return gap_starts, gap_ends
+
+
+def clip(intervals, period_start, period_end):
+    """
+    Returns the parts of merged intervals that lie within the period between period_start and period_end.
+    The first and the last interval in the period are found by binary search, so only the intervals
+    in the period are visited.
+    """
+    starts, ends = intervals
+    clipped_starts, clipped_ends = empty()
+    for i in range(bisect_right(ends, period_start), bisect_left(starts, period_end)):
+        clipped_starts.append(max(starts[i], period_start))
+        clipped_ends.append(min(ends[i], period_end))
+    return clipped_starts, clipped_ends
+
+
+def filter_by_duration(intervals, min_duration):
+    """
+    Returns the intervals that last at least min_duration seconds.
+    """
+    starts, ends = empty()
+    for start, end in zip(*intervals):
+        if end - start >= min_duration:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+def find_times_with_free_participants(interval_sets, k, period_start, period_end):
+    """
+    This function sweeps once over the sorted start and end points of the busy times of all participants
+    and returns the times in which at least k of them are free. The set of free participants is updated
+    as participants become busy or free, a time is split where the set changes.
+
+    :param interval_sets: A list of interval sets with the busy times of every participant
+    :param k: The minimal number of free participants
+    :param period_start: Epoch seconds of the start of the period
+    :param period_end: Epoch seconds of the end of the period
+    :return: A list of (start, end, free) tuples, where free is a tuple with the indices of the free participants
+    """
+    points = []
+    for index, (starts, ends) in enumerate(interval_sets):
+        for start, end in zip(starts, ends):
+            if start < period_end and end > period_start:
+                points.append((max(start, period_start), 1, index))
+                points.append((min(end, period_end), -1, index))
+    # sort the points by time, only the state between two different times is evaluated
+    points.sort()
+
+    busy = [0] * len(interval_sets)
+    free = set(range(len(interval_sets)))
+    # whether the set of free participants changed since the last free time was added
+    changed = True
+    free_times = []
+    current = period_start
+    i = 0
+    while current < period_end:
+        next_time = points[i][0] if i < len(points) else period_end
+        if next_time > current and len(free) >= k:
+            if free_times and free_times[-1][1] == current and not changed:
+                free_times[-1] = (free_times[-1][0], next_time, free_times[-1][2])
+            else:
+                # the tuple is only built once for every free time that is returned
+                free_times.append((current, next_time, tuple(sorted(free))))
+                changed = False
+        current = next_time
+        # whether every participant whose busy count changes at this time was free before
+        was_free = {}
+        while i < len(points) and points[i][0] == current:
+            _, change, index = points[i]
+            was_free.setdefault(index, index in free)
+            if busy[index] == 0 and change > 0:
+                free.discard(index)
+            busy[index] += change
+            if busy[index] == 0 and change < 0:
+                free.add(index)
+            i += 1
+        if any((index in free) != before for index, before in was_free.items()):
+            changed = True
+    return free_times
+
+
+def filter_free_times_by_duration(free_times, min_duration):
+    """
+    Returns the free times (see find_times_with_free_participants) of all spans that last at least
+    min_duration seconds. A span consists of free times that follow each other without a gap, so a long
+    span is kept even if the free participants change within it.
+    """
+    kept = []
+    span = []
+    for free_time in free_times + [None]:
+        if free_time is not None and span and span[-1][1] == free_time[0]:
+            span.append(free_time)
+            continue
+        if span and span[-1][1] - span[0][0] >= min_duration:
+            kept += span
+        span = [free_time]
+    return kept
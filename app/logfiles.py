@@ -0,0 +1,167 @@
+"""
+
+Log files
+
+Log files are rotated when they get too large or too old, the rotated files are named like the log file with
+the suffixes .1 (newest) to .BACKUP_COUNT (oldest). Rotated files older than MAX_AGE are deleted.
+The reader starts at the end of the newest file and reads backwards block by block, so showing the newest
+entries never reads the whole log.
+
+"""
+import json
+import logging.handlers
+import os
+import time
+
+# size in bytes after which a log file is rotated
+MAX_BYTES = 1024 * 1024
+# number of rotated files that are kept
+BACKUP_COUNT = 5
+# seconds after which a log file is rotated and a rotated file is deleted
+MAX_AGE = 14 * 24 * 60 * 60
+# bytes that are read at once when a file is read backwards
+BLOCK_SIZE = 64 * 1024
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler that also rotates the log file when its first entry is older than max_age
+    and deletes rotated files that are older than max_age.
+    """
+
+    def __init__(self, filename, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, max_age=MAX_AGE):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.max_age = max_age
+        self.started = self.get_start_time()
+
+    def get_start_time(self):
+        # the creation time of the log file is not available on every system, the time of its first
+        # entry is approximated by the modification time of the newest rotated file
+        try:
+            return os.stat(self.baseFilename + ".1").st_mtime
+        except OSError:
+            return time.time()
+
+    def shouldRollover(self, record):
+        if time.time() - self.started > self.max_age and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.started = time.time()
+        for index in range(1, self.backupCount + 1):
+            path = self.baseFilename + "." + str(index)
+            try:
+                if time.time() - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def read_lines_backwards(path, offset=None):
+    """
+    Yields the lines of a file from the end (or from the byte offset) to the beginning
+    together with the byte offset at which every line starts. Empty lines are skipped.
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END) if offset is None else offset
+        remainder = b""
+        while position > 0:
+            size = min(BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            block = f.read(size) + remainder
+            lines = block.split(b"\n")
+            # the first line can continue in the previous block
+            remainder = lines.pop(0)
+            end = position + len(block)
+            for line in reversed(lines):
+                start = end - len(line)
+                if line.strip():
+                    yield start, line.decode("utf-8", errors="replace")
+                end = start - 1
+        if remainder.strip():
+            yield 0, remainder.decode("utf-8", errors="replace")
+
+
+def parse_line(line):
+    """
+    Parses a log line, either a json line as written by applog or a line of the plain text format of the
+    server log. Returns None for lines that do not start an entry, e.g. the lines of a traceback.
+    The structured fields of a json line are returned as 'fields'.
+    """
+    if line.startswith("{"):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        fields = {key: value for key, value in entry.items() if key not in ("time", "level", "logger", "message")}
+        return {'time': entry.get("time", ""), 'application': entry.get("logger", ""), 'type': entry.get("level", ""),
+                'message': entry.get("message", ""), 'fields': fields}
+    parts = line.rstrip("\r\n").split(' ', 3)
+    if len(parts) < 4 or parts[2] not in LEVELS:
+        return None
+    return {'time': parts[0], 'application': parts[1], 'type': parts[2], 'message': parts[3], 'fields': {}}
+
+
+def get_log_files(path):
+    """
+    Returns the log file and its rotated files from the newest to the oldest.
+    """
+    return [path] + [path + "." + str(index) for index in range(1, BACKUP_COUNT + 1) if os.path.exists(path + "." + str(index))]
+
+
+def matches(entry, level, text):
+    if level and entry['type'] != level.upper():
+        return False
+    if not text:
+        return True
+    searchable = " ".join([entry['message']] + [str(value) for value in entry['fields'].values()])
+    return text.lower() in searchable.lower()
+
+
+def read_entries(path, limit=100, cursor=None, level=None, text=None):
+    """
+    This function returns the newest entries of a log file and its rotated files, the newest entry first.
+    Only as much of the files is read as is needed to find limit entries that match the filters.
+
+    :param path: The path of the log file
+    :param limit: The maximal number of entries
+    :param cursor: The cursor returned for the previous page, or None for the newest entries
+    :param level: Only entries of this level are returned, e.g. "ERROR"
+    :param text: Only entries whose message contains this text are returned, the case is ignored
+    :return: A list of entries and the cursor of the next page, or None if there are no older entries
+    """
+    files = get_log_files(path)
+    file_index, offset = 0, None
+    if cursor:
+        # the cursor is the index of the file and the offset of the last returned entry in it
+        file_index, _, offset = cursor.partition(":")
+        file_index, offset = int(file_index), int(offset) if offset else None
+
+    entries = []
+    while file_index < len(files):
+        try:
+            # lines that belong to an entry are read before the line that starts the entry
+            continuation = []
+            for start, line in read_lines_backwards(files[file_index], offset):
+                entry = parse_line(line)
+                if entry is None:
+                    continuation.insert(0, line)
+                    continue
+                if continuation:
+                    entry['message'] = "\n".join([entry['message']] + continuation)
+                    continuation = []
+                if matches(entry, level, text):
+                    entries.append(entry)
+                    if len(entries) == limit:
+                        if start > 0:
+                            return entries, str(file_index) + ":" + str(start)
+                        return entries, str(file_index + 1) + ":" if file_index + 1 < len(files) else None
+        except FileNotFoundError:
+            pass
+        file_index, offset = file_index + 1, None
+    return entries, None
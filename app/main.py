@@ -4,30 +4,20 @@ import os
 script_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
 
-import schedule
-import time
-import conanbot
-import mrkalender
-
-import applog
-
-
-
-print("Started scheduling")
-
-mrkalender.generate_mr_compare_calendar()
-conanbot.write_calendar()
-mrkalender.generate_mr_calendar()
-conanbot.write_ludwig_calendar()
-
-schedule.every(5).minutes.do(conanbot.write_ludwig_calendar)
-schedule.every(2).hours.do(conanbot.write_calendar)
-schedule.every(1).hours.do(mrkalender.generate_mr_calendar)
-schedule.every(1).hours.do(mrkalender.generate_mr_compare_calendar)
-
-while True:
-    try:
-        schedule.run_pending()
-        time.sleep(60)
-    except Exception as e:
-        applog.error(e)
+# the calendars are parsed in worker processes which import this module again, only the main process
+# imports the pipeline and schedules
+if __name__ == "__main__":
+    import functools
+    import mrkalender
+    import pipeline
+    import scheduler
+
+    print("Started scheduling")
+
+    # the calendars of pipelines.json run in one job per interval, every job runs once right after the start
+    for interval, timeout, filenames in pipeline.get_groups():
+        scheduler.add_job("calendars every " + str(interval) + " minutes", functools.partial(pipeline.run, filenames, timeout=timeout * 60),
+                          interval * 60, timeout * 60, jitter=min(interval * 3, 60))
+    scheduler.add_job("mr_calendar", mrkalender.generate_mr_calendar, 60 * 60, 15 * 60, jitter=60)
+
+    scheduler.run_forever()
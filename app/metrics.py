@@ -0,0 +1,88 @@
+"""
+
+Pipeline metrics
+
+Counters, gauges and timings of the pipeline stages are collected in memory by name and labels and written
+to METRICS together with the state of the scheduled jobs, so that the web app can export them in the
+Prometheus text format without talking to this process.
+
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import publish
+
+# file with the last snapshot of all metrics
+METRICS = "metrics.json"
+
+counters = {}
+gauges = {}
+# count and sum of the observed durations by name and labels
+summaries = {}
+metrics_lock = threading.Lock()
+
+
+def get_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = get_key(name, labels)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with metrics_lock:
+        gauges[get_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    key = get_key(name, labels)
+    with metrics_lock:
+        count, total = summaries.get(key, (0, 0.0))
+        summaries[key] = (count + 1, total + seconds)
+        gauges[get_key(name + "_last", labels)] = seconds
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Measures the duration of a pipeline stage as stage_duration_seconds. A stage that raises an exception
+    is counted in failures_total.
+
+    :param stage: The name of the stage, e.g. fetch, parse or serialise
+    :param labels: Further labels of the measurement, e.g. the source or the output
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except:
+        inc("failures_total", stage=stage, **labels)
+        raise
+    finally:
+        observe("stage_duration_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def snapshot():
+    """
+    Returns all metrics as json serialisable dictionary.
+    """
+    with metrics_lock:
+        return {
+            "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            "gauges": [[name, dict(labels), value] for (name, labels), value in gauges.items()],
+            "summaries": [[name, dict(labels), count, total] for (name, labels), (count, total) in summaries.items()]
+        }
+
+
+def write(jobs, path=METRICS):
+    """
+    Writes the snapshot of all metrics and the state of the jobs (see scheduler.get_status) for the web app.
+    """
+    metrics = snapshot()
+    metrics.update({"time": time.time(), "pid": os.getpid(), "jobs": jobs})
+    publish.write_atomically(path, json.dumps(metrics).encode("utf-8"))
@@ -1,61 +1,107 @@
 import feedparser
 import datetime
+import calendar
 import pytz
 from icalendar import Calendar, Event, vDatetime
 import os
 
 import icaltools
-import conanbot
+import fetcher
+import publish
+import doorstore
+import metrics
 
 def get_rss_items(url):
-    feed = feedparser.parse(url)
-    return feed.entries
+    """
+    Returns the entries of the rss feed and its new validators. The request is conditional on the etag and
+    modification date of the last fetch, so an unchanged feed returns an empty list and no validators.
+    The validators are only saved by the caller once the entries were stored, a failed run fetches them again.
+    """
+    validators = fetcher.load_validators(url)
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    # feedparser has no timeout of its own, a feed that never answers would hang the job
+    response = fetcher.session.get(url, headers=headers, timeout=fetcher.TIMEOUT)
+    if response.status_code == 304:
+        return [], None
+    response.raise_for_status()
+    validators = None
+    if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+    return feedparser.parse(response.content).entries, validators
 
-def generate_mr_compare_calendar():
-    ical_links = ["https://cloud.bau-ha.us/remote.php/dav/public-calendars/aQZoW4z6d8o8g7M4?export", "https://time.ludattel.de/calendar/subscribe/mrkalender"]
-    conanbot.generate_joint_calendar(ical_links, "Kombinierter MR Kalender", "mrcompare")
+def get_item_id(item):
+    return item.get("id") or item.get("link") or item["summary"]
 
 
 def generate_mr_calendar():
     # Use the URL of the RSS feed of your choice:
-    items = get_rss_items("https://social.bau-ha.us/@mr_door_status.rss")
-
-    items = sorted(items, key=lambda x:x['published_parsed'])
+    url = "https://social.bau-ha.us/@mr_door_status.rss"
+    with metrics.span("fetch", source="door-status"):
+        items, validators = get_rss_items(url)
 
     # Define the UTC timezone
     utc = pytz.UTC
 
-    filtered_list = []
-    current_start_item = None
-    for item in items:
-        if "OFFEN" in item["summary"]:
-            current_start_item = item
-        elif "GESCHLOSSEN" in item["summary"] and current_start_item != None:
-            dtstart = utc.localize(datetime.datetime(*current_start_item["published_parsed"][:6]))
-            dtend = utc.localize(datetime.datetime(*item["published_parsed"][:6]))
-            filtered_list.append([dtstart, dtend])
-            current_start_item = None
-
-    events = icaltools.create_ical_events_from_timespans(filtered_list, "maschinenraum offen")
-
-    # test if mrkalender.ics exists
-    # if yes, read it and compare with new events
-    # if no, write new events to mrkalender.ics
-    # if events are different, write new events to mrkalender.ics
-
-    if os.path.isfile("mrkalender.ics"):
-        with open("mrkalender.ics", 'rb') as f:
-            old_cal = Calendar.from_ical(f.read())
-        old_events = old_cal.walk('vevent')
-        events = icaltools.unite_events(events, old_events)
+    connection = doorstore.connect()
+    try:
+        # continue where the last run stopped, an interval that was opened back then is still open.
+        # Items are published with a precision of seconds, items of the second of the newest processed item
+        # can be new as well, so the processed items of this second are recognised by their id
+        last_published, open_since = doorstore.get_ingestion_state(connection, url)
+        processed = doorstore.get_processed_items(connection, url)
+        previous_published = last_published
+        items = [(calendar.timegm(item['published_parsed']), item) for item in items]
+        items = sorted(((published, item) for published, item in items if last_published is None or published > last_published
+                        or (published == last_published and get_item_id(item) not in processed)),
+                       key=lambda x: x[0])
+
+        filtered_list = []
+        for published, item in items:
+            if "OFFEN" in item["summary"]:
+                open_since = published
+            elif "GESCHLOSSEN" in item["summary"] and open_since != None:
+                dtstart = datetime.datetime.fromtimestamp(open_since, utc)
+                dtend = datetime.datetime.fromtimestamp(published, utc)
+                filtered_list.append([dtstart, dtend])
+                open_since = None
+            last_published = published
+
+        events = icaltools.create_ical_events_from_timespans(filtered_list, "maschinenraum offen")
 
+        # fill a new store once with the events of the existing calendar
+        if doorstore.is_empty(connection) and os.path.isfile("mrkalender.ics"):
+            with open("mrkalender.ics", 'rb') as f:
+                old_cal = Calendar.from_ical(f.read())
+            doorstore.add_events(connection, old_cal.walk('vevent'))
+        added = doorstore.add_events(connection, events)
+        metrics.inc("door_openings_total", added)
+        if last_published != previous_published:
+            processed = set()
+        processed |= set(get_item_id(item) for published, item in items if published == last_published)
+        doorstore.set_ingestion_state(connection, url, last_published, open_since, processed)
+        if validators is not None:
+            fetcher.save_validators(url, validators)
+        # only export the calendar if it changed
+        if added or not os.path.isfile("mrkalender.ics"):
+            export_mr_calendar(connection)
+    finally:
+        connection.close()
+
+
+def export_mr_calendar(connection):
+    """
+    This function publishes all events of the door status store as mrkalender.ics.
+    The events are stored serialised, so they are only joined and not serialised again.
+    """
     cal = Calendar()
     cal.add('prodid', '-//MR Usage Calendar//m18.uni-weimar.de//')
     cal.add('version', '2.0')
     cal.add('X-COLOR', '#FFC0CB')
     cal.add('timezone', {'tzid': 'UTC'})
-    for event in events:
-        cal.add_component(event)
-    with open("mrkalender.ics", 'wb') as f:
-        f.write(cal.to_ical())
-
+    # insert the stored events in front of END:VCALENDAR
+    header, footer = cal.to_ical().decode("utf-8").rsplit("END:VCALENDAR", 1)
+    publish.publish("mrkalender.ics", header + "".join(doorstore.get_serialised_events(connection)) + "END:VCALENDAR" + footer)
@@ -0,0 +1,425 @@
+"""
+
+Calendar pipelines
+
+The sources, transforms and outputs of all calendars are declared in pipelines.json. Every output consists of
+one or more branches, a branch selects the occurrences of its sources in the window of the output and applies
+its transforms in order. The events of all branches are published together.
+
+Transforms:
+    filter_keyword  keeps the occurrences with the keyword in their summary
+    exclude_fullday removes full day occurrences
+    min_duration    removes occurrences, or after invert free times, that are shorter than the given minutes,
+                    free times that follow each other without a gap count as one
+    quiet_hours     adds daily or weekly windows in which participants are not available to their busy times,
+                    to the busy times of the listed participants (source names, links or calendar names)
+                    or, without participants, of every source
+    sleep           adds a daily sleep time from start to end to the busy times of every source
+    invert          replaces the busy times with the free times, with missing > 0 the times in which
+                    all but that many sources are free
+
+A cycle runs a set of outputs as a graph: every unique link is fetched and parsed once for all outputs
+that use it, and every output runs as soon as its sources are ready, independent of the other outputs.
+
+"""
+import datetime
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import time as dttime
+from datetime import timedelta
+
+import icalendar
+import pytz
+
+import applog
+import conanbot
+import eventstore
+import fetcher
+import icaltools
+import intervals
+import metrics
+
+# file with the declaration of all pipelines
+CONFIG = "pipelines.json"
+# number of graph nodes that run at the same time
+MAX_WORKERS = 8
+
+TIMEZONE = pytz.timezone("Europe/Berlin")
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+def load_config(path=CONFIG):
+    with open(path, 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_two_months_window(now):
+    return conanbot.get_two_months_boundaries(now)
+
+
+def get_two_weeks_window(now):
+    # from midnight of today until the end of the next week
+    _, end = conanbot.get_two_week_boundaries(now.isocalendar()[:2])
+    return TIMEZONE.localize(datetime.datetime.combine(now.date(), dttime.min)), end
+
+
+def get_eight_weeks_window(now):
+    # from midnight of today until midnight eight weeks later
+    return (TIMEZONE.localize(datetime.datetime.combine(now.date(), dttime.min)),
+            TIMEZONE.localize(datetime.datetime.combine(now.date() + timedelta(weeks=8), dttime.min)))
+
+
+WINDOWS = {
+    "two_months": get_two_months_window,
+    "two_weeks": get_two_weeks_window,
+    "eight_weeks": get_eight_weeks_window
+}
+
+
+def parse_time(value):
+    hour, minute = value.split(":")
+    return dttime(int(hour), int(minute))
+
+
+def filter_keyword(selection, step):
+    keyword = step["keyword"].lower()
+    selection["lanes"] = [(source, [occurrence for occurrence in occurrences if keyword in occurrence.summary.lower()])
+                          for source, occurrences in selection["lanes"]]
+
+
+def exclude_fullday(selection, step):
+    selection["lanes"] = [(source, [occurrence for occurrence in occurrences if not occurrence.fullday])
+                          for source, occurrences in selection["lanes"]]
+
+
+def min_duration(selection, step):
+    duration = timedelta(minutes=step["minutes"]).total_seconds()
+    if selection["free"] is not None:
+        selection["free"] = intervals.filter_free_times_by_duration(selection["free"], duration)
+    else:
+        selection["lanes"] = [(source, [occurrence for occurrence in occurrences
+                                        if occurrence.end_time - occurrence.start_time >= duration])
+                              for source, occurrences in selection["lanes"]]
+
+
+# weekdays of weekly quiet hours
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def generate_quiet_hours(start, end, windows):
+    """
+    Generates the quiet hours of a list of windows between start and end as interval set. A window has a start
+    and an end time, a window that passes midnight ends on the next day. A window with days only applies to
+    the days (e.g. ["sat", "sun"]) on which it starts, otherwise it applies to every day.
+    """
+    quiet_hours = []
+    for window in windows:
+        weekdays = [WEEKDAYS.index(day.lower()) for day in window["days"]] if "days" in window else None
+        quiet_hours.append(conanbot.generate_sleep_intervals(start, end, parse_time(window["start"]), parse_time(window["end"]), weekdays))
+    return intervals.union(*quiet_hours)
+
+
+def quiet_hours(selection, step):
+    mask = generate_quiet_hours(selection["start"], selection["end"], step["windows"])
+    summary = step.get("summary", "Sleeping")
+    if "participants" not in step:
+        selection["masks"].append((summary, mask))
+        return
+    for source, _ in selection["lanes"]:
+        if any(source.source in selection["participants_by_name"].get(participant, ()) or participant == source.name
+               for participant in step["participants"]):
+            selection["participant_masks"].setdefault(source.source, []).append((summary, mask))
+
+
+def sleep(selection, step):
+    quiet_hours(selection, {"summary": step.get("summary", "Sleeping"),
+                            "windows": [{"start": step.get("start", "22:00"), "end": step.get("end", "09:00")}]})
+
+
+def invert(selection, step):
+    start, end = int(selection["start"].timestamp()), int(selection["end"].timestamp())
+    masks = intervals.union(*[mask for _, mask in selection["masks"]])
+    busy_times = [get_lane_busy_times(selection, source, occurrences) for source, occurrences in selection["lanes"]]
+    selection["summary"] = step.get("summary", "Möglicher Termin")
+    missing = step.get("missing", 0)
+    if missing:
+        k = max(len(busy_times) - missing, 1)
+        selection["participants"] = (k, len(busy_times))
+        selection["free"] = intervals.find_times_with_free_participants([intervals.union(busy, masks) for busy in busy_times],
+                                                                        k, start, end)
+    else:
+        free_times = intervals.complement(intervals.union(masks, *busy_times), start, end)
+        selection["free"] = [(free_start, free_end, None) for free_start, free_end in zip(*free_times)]
+
+
+TRANSFORMS = {
+    "filter_keyword": filter_keyword,
+    "exclude_fullday": exclude_fullday,
+    "min_duration": min_duration,
+    "quiet_hours": quiet_hours,
+    "sleep": sleep,
+    "invert": invert
+}
+
+
+def get_busy_times(occurrences):
+    return intervals.merge(intervals.from_pairs((occurrence.start_time, occurrence.end_time) for occurrence in occurrences))
+
+
+def get_lane_busy_times(selection, source, occurrences):
+    """
+    Returns the busy times of a source of the selection including its own quiet hours.
+    """
+    return intervals.union(get_busy_times(occurrences), *[mask for _, mask in selection["participant_masks"].get(source.source, [])])
+
+
+def get_links(config, source_names):
+    """
+    Returns the links of the named sources of the config without duplicates.
+    """
+    links = []
+    for name in source_names:
+        source = config["sources"][name]
+        for link in conanbot.parse_file(source["file"]) if "file" in source else source["links"]:
+            if link not in links:
+                links.append(link)
+    return links
+
+
+def select(connection, config, branch, sources, start, end):
+    """
+    This function selects the stored occurrences of the sources of a branch and applies its transforms.
+
+    :param connection: A connection returned by eventstore.connect
+    :param config: The pipeline config
+    :param branch: The declaration of the branch
+    :param sources: A dictionary with the eventstore.Source of every link, None for sources that failed
+    :param start: A timezone-aware datetime object representing the start of the window
+    :param end: A timezone-aware datetime object representing the end of the window
+    :return: The selection, a dictionary with the occurrences of every source (lanes), the busy times that apply
+             to all sources (masks) or to single sources (participant_masks) and, once inverted, the free times
+    """
+    lanes = []
+    for link in get_links(config, branch["sources"]):
+        source = sources.get(link)
+        if source is not None:
+            lanes.append((source, eventstore.get_occurrences(connection, [source.source], int(start.timestamp()), int(end.timestamp()))))
+    # the ids of the sources by source name and by link, quiet hours can be declared for both
+    participants_by_name = {name: [sources[link].source for link in get_links(config, [name]) if sources.get(link) is not None]
+                            for name in branch["sources"]}
+    participants_by_name.update({link: [source.source] for link, source in sources.items() if source is not None})
+    selection = {"start": start, "end": end, "lanes": lanes, "participants_by_name": participants_by_name, "masks": [], "participant_masks": {},
+                 "free": None, "participants": None, "summary": None}
+    for step in branch.get("transforms", []):
+        TRANSFORMS[step["type"]](selection, step)
+    return selection
+
+
+def create_events(selection, label):
+    """
+    Creates the icalendar.Event objects of a selection.
+
+    :param selection: A selection returned by select
+    :param label: Whether the events are labeled with the name and color of their source
+    :return: A list of icalendar.Event objects
+    """
+    tz = selection["start"].tzinfo
+    if selection["free"] is not None:
+        if selection["participants"] is None:
+            free_times = intervals.from_pairs((start, end) for start, end, _ in selection["free"])
+            return conanbot.create_ical_events_from_timespans(intervals.to_datetimes(free_times, tz), selection["summary"])
+        names = [source.name or source.source for source, _ in selection["lanes"]]
+        events = []
+        for start, end, free in selection["free"]:
+            summary = selection["summary"] + " (" + str(len(free)) + "/" + str(len(names)) + ": " + ", ".join(names[index] for index in free) + ")"
+            timespan = (datetime.datetime.fromtimestamp(start, tz), datetime.datetime.fromtimestamp(end, tz))
+            events += conanbot.create_ical_events_from_timespans([timespan], summary)
+        return events
+
+    events = []
+    for source, occurrences in selection["lanes"]:
+        source_events = [icalendar.Event.from_ical(eventstore.get_vevent(occurrence)) for occurrence in occurrences]
+        if label:
+            source_name = source.name or "Unnamed Calendar"
+            source_events = [icaltools.prepend_description(event, source_name) for event in source_events]
+            source_events = [icaltools.prepend_category(event, source_name) for event in source_events]
+            source_events = [icaltools.add_property(event, "COLOR", source.color) for event in source_events]
+        events += source_events
+    # quiet hours only become events in calendars that show the busy times
+    for summary, mask in selection["masks"]:
+        events += conanbot.generate_sleep_events(mask, tz, summary)
+    for source, _ in selection["lanes"]:
+        for summary, mask in selection["participant_masks"].get(source.source, []):
+            events += conanbot.generate_sleep_events(mask, tz, summary + " (" + (source.name or source.source) + ")")
+    return events
+
+
+def generate_output(config, filename, now, sources):
+    """
+    This function generates and publishes one output of the config.
+
+    :param config: The pipeline config
+    :param filename: The name of the output, the published files are named after it
+    :param now: A timezone-aware datetime object, the windows of the cycle are computed from it
+    :param sources: A dictionary with the eventstore.Source of every link, None for sources that failed
+    """
+    output = config["outputs"][filename]
+    start, end = WINDOWS[output["window"]](now)
+
+    with metrics.span("select", output=filename):
+        connection = eventstore.connect()
+        try:
+            selections = [select(connection, config, branch, sources, start, end) for branch in output["branches"]]
+        finally:
+            connection.close()
+
+    lanes = [lane for selection in selections for lane in selection["lanes"]]
+    vtimezones = []
+    used_sources = []
+    for source, _ in lanes:
+        if source.source not in used_sources:
+            used_sources.append(source.source)
+            vtimezones += conanbot.parse_vtimezones(source.vtimezones)
+
+    with metrics.span("create_events", output=filename):
+        events = []
+        for selection in selections:
+            events += create_events(selection, output.get("label", False))
+        if output.get("localize", False):
+            events = icaltools.localize_aware_events(events)
+    metrics.set_gauge("output_events", len(events), output=filename)
+    participants = next((selection["participants"] for selection in selections if selection["participants"]), (len(lanes), len(lanes)))
+
+    for file_format in output["formats"]:
+        with metrics.span("serialise", output=filename, format=file_format):
+            if file_format == "ics":
+                name = output["name"].format(k=participants[0], n=participants[1])
+                conanbot.export_calendar(filename + ".ics", conanbot.generate_new_icalendar(name, vtimezones, events))
+            elif file_format == "json":
+                conanbot.export_calendar_as_json(filename + ".json", events)
+            elif file_format == "busy_times":
+                masks = intervals.union(*[mask for selection in selections for _, mask in selection["masks"]])
+                conanbot.export_busy_times(filename + ".json", [(source.source, source.name, get_lane_busy_times(selection, source, occurrences))
+                                                                for selection in selections for source, occurrences in selection["lanes"]],
+                                           masks, start, end)
+
+
+def update_link(link, start, end, deadline=None):
+    """
+    Fetches a link and updates its occurrences in the event store for the window between start and end.
+    Parsing is given up when the deadline (a time.monotonic() value) passed.
+
+    :return: The eventstore.Source or None if the link could not be fetched or parsed
+    """
+    feed = fetcher.fetch(link)
+    if feed is None:
+        return None
+    connection = eventstore.connect()
+    try:
+        return conanbot.update_source(connection, link, feed, start, end, deadline)
+    finally:
+        connection.close()
+
+
+def run_graph(nodes, deadline=None):
+    """
+    This function runs a graph of functions on the worker pool. Every node starts as soon as all of its
+    dependencies finished, a node whose dependency failed is not run. Once the deadline passed, the nodes
+    that did not finish are given up: nodes that did not start yet are cancelled, running nodes go on
+    in the background but their results are ignored.
+
+    :param nodes: A dictionary with a (dependencies, function) tuple for every node name,
+                  the function is called with a dictionary of the results of the dependencies
+    :param deadline: The time.monotonic() value until which the graph has to finish or None
+    :return: A dictionary with the result of every node that finished and a list with the names of the failed nodes
+    """
+    results = {}
+    failed = []
+    pending = dict(nodes)
+    running = {}
+    # the nodes log with the context of the caller, e.g. the name of the job
+    context = applog.get_context()
+    while pending or running:
+        for name, (dependencies, function) in list(pending.items()):
+            if any(dependency in failed for dependency in dependencies):
+                failed.append(name)
+                del pending[name]
+            elif all(dependency in results for dependency in dependencies):
+                running[executor.submit(applog.run_with_context, context, function,
+                                        {dependency: results[dependency] for dependency in dependencies})] = name
+                del pending[name]
+        if not running:
+            break
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        done, _ = wait(list(running), timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            for future, name in running.items():
+                future.cancel()
+                failed.append(name)
+            applog.error("Could not run " + ", ".join(running.values()) + " before the deadline", nodes=list(running.values()))
+            break
+        for future in done:
+            name = running.pop(future)
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                applog.error("Could not run " + name + ": " + str(e), node=name)
+                failed.append(name)
+    return results, failed + list(pending)
+
+
+def run(filenames, config=None, timeout=None):
+    """
+    This function runs one cycle of the named outputs. Every link that is used by any of the outputs is fetched
+    and parsed only once, for the union of the windows of the outputs that use it.
+
+    :param filenames: A list of output names of the config
+    :param config: The pipeline config, by default it is read from CONFIG
+    :param timeout: Seconds after which the outputs that did not finish yet are given up or None
+    """
+    config = config or load_config()
+    now = datetime.datetime.now(TIMEZONE)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    windows = {}
+    links_by_output = {}
+    for filename in filenames:
+        output = config["outputs"][filename]
+        start, end = WINDOWS[output["window"]](now)
+        links_by_output[filename] = get_links(config, [name for branch in output["branches"] for name in branch["sources"]])
+        for link in links_by_output[filename]:
+            window = windows.get(link, (start, end))
+            windows[link] = (min(window[0], start), max(window[1], end))
+
+    nodes = {}
+    for link, (start, end) in windows.items():
+        nodes["source " + link] = ([], lambda results, link=link, start=start, end=end: update_link(link, start, end, deadline))
+    for filename in filenames:
+        dependencies = ["source " + link for link in links_by_output[filename]]
+        nodes["output " + filename] = (dependencies, lambda results, filename=filename: generate_output(
+            config, filename, now, {name[len("source "):]: source for name, source in results.items()}))
+
+    cycle_start = time.perf_counter()
+    with metrics.span("cycle", outputs=",".join(filenames)):
+        _, failed = run_graph(nodes, deadline)
+    applog.info("Cycle of " + ", ".join(filenames) + " finished", outputs=filenames, failed=failed, duration=time.perf_counter() - cycle_start)
+    for filename in filenames:
+        metrics.set_gauge("output_success", 0 if "output " + filename in failed else 1, output=filename)
+    if failed:
+        raise RuntimeError("Could not generate " + ", ".join(failed))
+
+
+def get_groups(config=None):
+    """
+    Groups the outputs of the config by their interval, the outputs of a group run in the same cycle.
+
+    :return: A list of (interval, timeout, output names) tuples, interval and timeout are minutes
+    """
+    config = config or load_config()
+    groups = {}
+    for filename, output in config["outputs"].items():
+        timeout, filenames = groups.get(output["interval"], (0, []))
+        groups[output["interval"]] = (max(timeout, output["timeout"]), filenames + [filename])
+    return [(interval, timeout, filenames) for interval, (timeout, filenames) in sorted(groups.items())]
@@ -0,0 +1,58 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+# file with the digest, size and modification time of every published file
+MANIFEST = "manifest.json"
+
+manifest_lock = threading.Lock()
+
+
+def write_atomically(path, content):
+    """
+    Writes the bytes to a temporary file next to the path and renames it afterwards,
+    so that a reader never sees a half written file.
+    """
+    temp_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def load_manifest(directory="."):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def publish(filename, content):
+    """
+    This function publishes a file for the web app. The file and a gzip compressed copy (filename + ".gz") are
+    replaced atomically and the manifest is updated with their digest and size, so the web app can
+    send precompressed bytes and ETags without hashing the file on every request.
+
+    :param filename: The path of the published file
+    :param content: The content as bytes or string
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    write_atomically(filename, content)
+    # mtime=0 keeps the compressed bytes identical for identical content
+    write_atomically(filename + ".gz", gzip.compress(content, mtime=0))
+
+    entry = {
+        "sha1": hashlib.sha1(content).hexdigest(),
+        "size": len(content),
+        "mtime": os.stat(filename).st_mtime_ns,
+        "gzip_size": os.stat(filename + ".gz").st_size,
+        "gzip_mtime": os.stat(filename + ".gz").st_mtime_ns
+    }
+    directory, name = os.path.split(filename)
+    with manifest_lock:
+        manifest = load_manifest(directory or ".")
+        manifest[name] = entry
+        write_atomically(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2).encode("utf-8"))
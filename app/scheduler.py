@@ -0,0 +1,206 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import applog
+import metrics
+
+# number of jobs that can run at the same time
+MAX_WORKERS = 4
+# seconds between two checks for due jobs and exceeded deadlines
+POLL_INTERVAL = 1
+# seconds between two snapshots of the metrics and the job states for the web app
+METRICS_INTERVAL = 15
+# seconds a job gets after its timeout to stop by itself before the scheduler abandons it
+GRACE = 60
+
+# state and statistics of every job by name
+jobs = {}
+jobs_lock = threading.Lock()
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+def add_job(name, function, interval, timeout, jitter=0, run_now=True):
+    """
+    This function registers a job that is run periodically on the worker pool.
+
+    :param name: A unique name of the job
+    :param function: The function that is called without arguments
+    :param interval: Seconds between two runs
+    :param timeout: Seconds after which a run is reported as timed out, GRACE seconds later it is abandoned
+    :param jitter: Up to this many seconds are added randomly to every run time,
+                   so jobs with the same interval do not always start at the same moment
+    :param run_now: Whether the first run is due immediately or after one interval
+    """
+    now = time.monotonic()
+    with jobs_lock:
+        jobs[name] = {
+            "name": name,
+            "function": function,
+            "interval": interval,
+            "timeout": timeout,
+            "jitter": jitter,
+            # the time the next run is due without jitter, the jitter is only added to the run time itself
+            "base_run": now if run_now else now + interval,
+            "next_run": now if run_now else now + interval + random.uniform(0, jitter),
+            "running": False,
+            "started": None,
+            # the thread of an abandoned run, the job stays running until it returned
+            "abandoned": None,
+            "timed_out": False,
+            "runs": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "skipped": 0,
+            "last_duration": None,
+            "last_lag": None,
+            "last_success": None,
+            "last_result": None,
+            "last_error": None
+        }
+
+
+def call_with_timeout(function, timeout):
+    """
+    Calls the function in its own thread and waits at most timeout seconds for it to return. Threads cannot be
+    killed, a function that does not return in time is abandoned and goes on in the background.
+
+    :return: The thread, whether the function returned in time and the exception it raised or None
+    """
+    outcome = {}
+    context = applog.get_context()
+
+    def target():
+        try:
+            applog.run_with_context(context, function)
+            outcome["error"] = None
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return thread, "error" in outcome, outcome.get("error")
+
+
+def run_job(job, scheduled):
+    # every entry that is logged during the run names the job
+    applog.set_context(job=job["name"])
+    started = time.monotonic()
+    with jobs_lock:
+        job["started"] = started
+        # lag is the time between the moment the run was due and the moment it actually started
+        job["last_lag"] = started - scheduled
+    error = None
+    thread, finished, exception = call_with_timeout(job["function"], job["timeout"] + GRACE)
+    if not finished:
+        # the worker is released, but the job only runs again once the abandoned run returned,
+        # so two runs never work on the same files at the same time
+        applog.error("Job " + job["name"] + " was abandoned " + str(GRACE) + " seconds after its timeout",
+                     duration=time.monotonic() - started)
+        error = "abandoned after timeout of " + str(job["timeout"]) + " seconds"
+    elif exception is not None:
+        applog.error("Job " + job["name"] + " failed: " + str(exception), duration=time.monotonic() - started)
+        error = str(exception)
+    with jobs_lock:
+        job["last_duration"] = time.monotonic() - started
+        job["runs"] += 1
+        if error is None:
+            job["last_success"] = time.time()
+            job["last_result"] = "success"
+        else:
+            job["failures"] += 1
+            job["last_result"] = "failure"
+            job["last_error"] = error
+        job["running"] = not finished
+        job["abandoned"] = None if finished else thread
+        job["started"] = None
+    applog.set_context()
+    metrics.write(get_status())
+
+
+def start_due_jobs(now):
+    """
+    Submits every job whose run time has come to the worker pool. A job whose previous run has not finished yet
+    is skipped until its next run time, so a slow job never piles up or occupies more than one worker.
+    """
+    with jobs_lock:
+        for job in jobs.values():
+            if job["next_run"] > now:
+                continue
+            scheduled = job["next_run"]
+            # the next run is planned from the unjittered due time, not from the end of the run or the jittered
+            # run time, so neither the duration of the runs nor the jitter make the schedule drift
+            job["base_run"] = max(job["base_run"] + job["interval"], now)
+            job["next_run"] = job["base_run"] + random.uniform(0, job["jitter"])
+            if job["abandoned"] is not None and not job["abandoned"].is_alive():
+                applog.info("Abandoned run of job " + job["name"] + " returned", job=job["name"])
+                job["abandoned"] = None
+                job["running"] = False
+            if job["running"]:
+                job["skipped"] += 1
+                applog.info("Job " + job["name"] + " is still running, skipped this run", job=job["name"])
+                continue
+            job["running"] = True
+            job["timed_out"] = False
+            executor.submit(run_job, job, scheduled)
+
+
+def check_deadlines(now):
+    """
+    Reports every running job that exceeded its timeout once. Jobs that take a timeout (see pipeline.run)
+    stop by themselves, other jobs are abandoned GRACE seconds after their timeout (see run_job).
+    """
+    with jobs_lock:
+        for job in jobs.values():
+            started = job["started"]
+            if job["running"] and started is not None and not job["timed_out"] and now - started > job["timeout"]:
+                job["timed_out"] = True
+                job["timeouts"] += 1
+                job["last_error"] = "timeout after " + str(job["timeout"]) + " seconds"
+                applog.error("Job " + job["name"] + " exceeded its timeout of " + str(job["timeout"]) + " seconds",
+                             job=job["name"], duration=now - started)
+
+
+def get_status():
+    """
+    Returns a dictionary with the statistics of every job by name. Intervals, timeouts, durations and lags
+    are seconds, last_success is epoch seconds.
+    """
+    now = time.monotonic()
+    with jobs_lock:
+        return {job["name"]: {
+            "interval": job["interval"],
+            "timeout": job["timeout"],
+            "running": job["running"],
+            "abandoned": job["abandoned"] is not None,
+            "running_for": now - job["started"] if job["started"] is not None else None,
+            "timed_out": job["timed_out"],
+            "runs": job["runs"],
+            "failures": job["failures"],
+            "timeouts": job["timeouts"],
+            "skipped": job["skipped"],
+            "last_duration": job["last_duration"],
+            "last_lag": job["last_lag"],
+            "last_success": job["last_success"],
+            "last_result": job["last_result"],
+            "last_error": job["last_error"],
+            "next_run_in": max(job["next_run"] - now, 0)
+        } for job in jobs.values()}
+
+
+def run_forever():
+    last_metrics = 0
+    while True:
+        try:
+            now = time.monotonic()
+            check_deadlines(now)
+            start_due_jobs(now)
+            if now - last_metrics >= METRICS_INTERVAL:
+                metrics.write(get_status())
+                last_metrics = now
+        except Exception as e:
+            applog.error(e)
+        time.sleep(POLL_INTERVAL)
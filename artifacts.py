@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from flask import Response, abort, request
+
+# a published file of the calendar bot kept in memory, gzip_body is None if there is no precompressed copy,
+# manifest_mtime is the modification time of the manifest if the file was read before it was in the manifest
+Artifact = namedtuple("Artifact", ["mtime", "size", "body", "etag", "last_modified", "gzip_body", "manifest_mtime"])
+
+# seconds a calendar client may use its copy before it has to revalidate it
+MAX_AGE = 300
+
+# artifacts by path
+artifacts = {}
+artifacts_lock = threading.Lock()
+
+# manifests written by publish.publish by directory together with their modification time
+manifests = {}
+
+
+def get_manifest_mtime(directory):
+    try:
+        return os.stat(os.path.join(directory, "manifest.json")).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def load_manifest(directory):
+    """
+    Returns the modification time and the content of the manifest of a directory, (0, {}) if there is none.
+    """
+    path = os.path.join(directory, "manifest.json")
+    mtime = get_manifest_mtime(directory)
+    if not mtime:
+        return 0, {}
+    cached = manifests.get(directory)
+    if cached and cached[0] == mtime:
+        return cached
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return mtime, {}
+    manifests[directory] = (mtime, manifest)
+    return mtime, manifest
+
+
+def get_artifact(path):
+    """
+    Returns the content of a published file. The file is only read from disk again if its modification time
+    or size changed since the last call, otherwise the cached bytes are returned.
+    The ETag and the precompressed copy are taken from the manifest of the calendar bot, files that are not
+    in the manifest are hashed when they are read. A file can be read before the calendar bot added it to the
+    manifest, such a file is read again once the manifest changed.
+
+    :param path: The path of the file
+    :return: An Artifact
+    """
+    stat = os.stat(path)
+    directory, name = os.path.split(path)
+    artifact = artifacts.get(path)
+    if artifact and artifact.mtime == stat.st_mtime_ns and artifact.size == stat.st_size and \
+            (artifact.manifest_mtime is None or artifact.manifest_mtime == get_manifest_mtime(directory)):
+        return artifact
+
+    with open(path, 'rb') as f:
+        body = f.read()
+    manifest_mtime, manifest = load_manifest(directory)
+    entry = manifest.get(name)
+    gzip_body = None
+    if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == len(body):
+        manifest_mtime = None
+        etag = entry["sha1"]
+        try:
+            # the compressed copy belongs to this version only if it was not replaced since the manifest was written
+            if os.stat(path + ".gz").st_mtime_ns == entry["gzip_mtime"]:
+                with open(path + ".gz", 'rb') as f:
+                    gzip_body = f.read()
+        except OSError:
+            pass
+    else:
+        etag = hashlib.sha1(body).hexdigest()
+    artifact = Artifact(stat.st_mtime_ns, stat.st_size, body, etag,
+                        datetime.fromtimestamp(int(stat.st_mtime), timezone.utc), gzip_body, manifest_mtime)
+    with artifacts_lock:
+        artifacts[path] = artifact
+    return artifact
+
+
+def send_artifact(path, mimetype, private=False):
+    """
+    Creates a response for a published file with a strong ETag, Last-Modified and Cache-Control header.
+    Clients that accept gzip get the precompressed copy. A client that still has the current version
+    gets an empty 304 response.
+
+    :param path: The path of the file
+    :param mimetype: The mimetype of the response
+    :param private: Whether shared caches must not store the response, e.g. for password protected calendars
+    :return: A flask.Response
+    """
+    try:
+        artifact = get_artifact(path)
+    except FileNotFoundError:
+        abort(404)
+    if artifact.gzip_body is not None and request.accept_encodings['gzip']:
+        response = Response(artifact.gzip_body, mimetype=mimetype)
+        response.content_encoding = 'gzip'
+        # every encoding of the file needs its own strong ETag
+        response.set_etag(artifact.etag + '-gzip')
+    else:
+        response = Response(artifact.body, mimetype=mimetype)
+        response.set_etag(artifact.etag)
+    response.vary.add('Accept-Encoding')
+    response.last_modified = artifact.last_modified
+    response.cache_control.max_age = MAX_AGE
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response.make_conditional(request)
@@ -0,0 +1,126 @@
+import json
+import os
+from datetime import datetime
+
+import pytz
+
+# the interval engine of the calendar bot, app.py makes the app directory importable
+import intervals
+
+# directory in which the calendar bot publishes its calendars
+CALENDAR_DIR = "app"
+
+timezone = pytz.timezone("Europe/Berlin")
+
+# busy times of the last cycle together with the modification time of their file
+busy_times = {"mtime": None}
+
+
+def load_busy_times():
+    """
+    Returns the busy times published by conanbot.export_busy_times. The file is read from disk only
+    if it was published again since the last call, otherwise the interval sets are already in memory.
+    """
+    path = os.path.join(CALENDAR_DIR, "busy-times.json")
+    mtime = os.stat(path).st_mtime_ns
+    if busy_times["mtime"] == mtime:
+        return busy_times
+
+    with open(path, 'r') as f:
+        raw = json.load(f)
+    sources = {}
+    for source in raw["sources"]:
+        sources[source["id"]] = {
+            "name": source["name"],
+            "busy": intervals.from_pairs(zip(source["starts"], source["ends"]))
+        }
+    busy_times.update({
+        "mtime": mtime,
+        "start": raw["start"],
+        "end": raw["end"],
+        "sources": sources,
+        "sleep": intervals.from_pairs(zip(raw["sleep"]["starts"], raw["sleep"]["ends"]))
+    })
+    # the busy times of all sources together and the free times between them are the same for every free time query
+    if "merged" in raw:
+        merged = intervals.from_pairs(zip(raw["merged"]["starts"], raw["merged"]["ends"]))
+    else:
+        merged = intervals.union(busy_times["sleep"], *[source["busy"] for source in sources.values()])
+    busy_times["free"] = intervals.complement(merged, raw["start"], raw["end"])
+    return busy_times
+
+
+def get_sources():
+    """
+    Returns a list of the ids and names of all sources that can be queried.
+    """
+    return [{"id": source_id, "name": source["name"]} for source_id, source in load_busy_times()["sources"].items()]
+
+
+def find_source(key):
+    # sources can be selected by their id or by their calendar name
+    sources = load_busy_times()["sources"]
+    if key in sources:
+        return key
+    for source_id, source in sources.items():
+        if source["name"].lower() == key.lower():
+            return source_id
+    return None
+
+
+def parse_time(value, default):
+    """
+    Parses an iso formatted time from a query. Times without timezone are in Europe/Berlin.
+    Returns epoch seconds.
+    """
+    if not value:
+        return default
+    time = datetime.fromisoformat(value)
+    if not time.tzinfo:
+        time = timezone.localize(time)
+    return int(time.timestamp())
+
+
+class PeriodError(ValueError):
+    """
+    Raised for a period that is not covered by the generated busy times.
+    """
+
+
+def find_free_slots(min_duration, start=None, end=None):
+    """
+    Returns the times in which all sources are free for at least min_duration seconds, sleep time excluded.
+    The free times are computed once per cycle, a query only searches the free times in its period.
+    The busy times are generated for the window of the busy-times output in pipelines.json, a period
+    that is not within this window raises a PeriodError instead of being cut off silently.
+
+    :param min_duration: The minimal duration in seconds
+    :param start: Epoch seconds of the start of the period or None
+    :param end: Epoch seconds of the end of the period or None
+    :return: A list of (start, end) pairs of datetime objects
+    """
+    busy_times = load_busy_times()
+    start = busy_times["start"] if start is None else start
+    end = busy_times["end"] if end is None else end
+    if start < busy_times["start"] or end > busy_times["end"]:
+        covered_start, covered_end = intervals.to_datetimes(([busy_times["start"]], [busy_times["end"]]), timezone)[0]
+        raise PeriodError("free times are only known from " + covered_start.isoformat() + " to " + covered_end.isoformat())
+    free_times = intervals.filter_by_duration(intervals.clip(busy_times["free"], start, end), min_duration)
+    return intervals.to_datetimes(free_times, timezone)
+
+
+def find_common_free_times(source_ids, start=None, end=None):
+    """
+    Returns the times in which all given sources are free, sleep time excluded.
+    The period is limited to the period the busy times were generated for.
+
+    :param source_ids: A list of source ids (see find_source)
+    :param start: Epoch seconds of the start of the period or None
+    :param end: Epoch seconds of the end of the period or None
+    :return: A list of (start, end) pairs of datetime objects
+    """
+    busy_times = load_busy_times()
+    start = max(start or busy_times["start"], busy_times["start"])
+    end = min(end or busy_times["end"], busy_times["end"])
+    busy = intervals.union(busy_times["sleep"], *[busy_times["sources"][source_id]["busy"] for source_id in source_ids])
+    return intervals.to_datetimes(intervals.complement(busy, start, end), timezone)
@@ -0,0 +1,111 @@
+"""
+
+Synthetic calendar feeds
+
+Generates ics files that look like the member calendars of the bot: single events spread over the history,
+weekly and daily recurring events with and without an end, edited occurrences, full day events,
+events in Europe/Berlin with a VTIMEZONE and events in UTC. The same seed always yields the same feeds.
+
+"""
+import datetime
+import random
+
+VTIMEZONE = "\r\n".join([
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Berlin",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE"
+])
+
+SUMMARIES = ["Vorlesung", "Sport", "Arbeit", "Treffen", "Chor", "Zahnarzt", "Detektiv Conan", "Einkaufen"]
+
+
+def format_time(value, utc):
+    if utc:
+        return ":" + value.astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return ";TZID=Europe/Berlin:" + value.strftime("%Y%m%dT%H%M%S")
+
+
+def generate_event(rng, uid, start, duration, rrule=None, fullday=False, utc=False, recurrence_id=None):
+    lines = ["BEGIN:VEVENT", "UID:" + uid, "DTSTAMP:20230101T000000Z", "SUMMARY:" + rng.choice(SUMMARIES)]
+    if fullday:
+        lines.append("DTSTART;VALUE=DATE:" + start.strftime("%Y%m%d"))
+        lines.append("DTEND;VALUE=DATE:" + (start + datetime.timedelta(days=1)).strftime("%Y%m%d"))
+    else:
+        lines.append("DTSTART" + format_time(start, utc))
+        lines.append("DTEND" + format_time(start + duration, utc))
+    if rrule:
+        lines.append("RRULE:" + rrule)
+    if recurrence_id:
+        lines.append("RECURRENCE-ID" + format_time(recurrence_id, utc))
+    lines.append("END:VEVENT")
+    return "\r\n".join(lines)
+
+
+def generate_feed(name, events=500, recurring=0.1, history_years=3, future_weeks=16, seed=0, now=None):
+    """
+    This function generates the ics file of one member.
+
+    :param name: The X-WR-CALNAME of the calendar
+    :param events: The number of VEVENT components
+    :param recurring: The share of events with an RRULE, half of them weekly and half of them daily
+    :param history_years: How far back the events reach
+    :param future_weeks: How far ahead the events reach
+    :param seed: The seed of the random generator
+    :param now: A timezone-aware datetime object, the events are spread around it
+    :return: The content of the ics file as string
+    """
+    rng = random.Random(name + str(seed))
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    first = now - datetime.timedelta(days=365 * history_years)
+    span = (now + datetime.timedelta(weeks=future_weeks) - first).total_seconds()
+
+    components = []
+    for i in range(events):
+        uid = name + "-" + str(i) + "@benchmark"
+        start = first + datetime.timedelta(seconds=rng.uniform(0, span))
+        start = start.replace(minute=rng.choice([0, 15, 30, 45]), second=0, microsecond=0)
+        duration = datetime.timedelta(minutes=rng.choice([30, 60, 90, 120, 180]))
+        utc = rng.random() < 0.3
+        if rng.random() < recurring:
+            if rng.random() < 0.5:
+                # weekly, some of them end after a number of weeks
+                rrule = "FREQ=WEEKLY" if rng.random() < 0.5 else "FREQ=WEEKLY;COUNT=" + str(rng.randint(4, 40))
+            else:
+                until = start + datetime.timedelta(days=rng.randint(5, 120))
+                rrule = "FREQ=DAILY;UNTIL=" + until.astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            components.append(generate_event(rng, uid, start, duration, rrule=rrule, utc=utc))
+            # an edited occurrence moves the second occurrence by an hour
+            if rng.random() < 0.2 and rrule.startswith("FREQ=WEEKLY"):
+                second = start + datetime.timedelta(weeks=1)
+                components.append(generate_event(rng, uid, second + datetime.timedelta(hours=1), duration, utc=utc,
+                                                 recurrence_id=second))
+        else:
+            components.append(generate_event(rng, uid, start, duration, fullday=rng.random() < 0.1, utc=utc))
+
+    return "\r\n".join(["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//ConanBot//Benchmark//DE", "X-WR-CALNAME:" + name,
+                        VTIMEZONE] + components + ["END:VCALENDAR"]) + "\r\n"
+
+
+def generate_feeds(members=3, events=500, recurring=0.1, history_years=3, future_weeks=16, seed=0):
+    """
+    Generates the ics files of several members.
+
+    :return: A dictionary that maps the file name of every member to the content of its ics file
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {"member" + str(i) + ".ics": generate_feed("Member" + str(i), events, recurring, history_years, future_weeks, seed, now)
+            for i in range(members)}
@@ -0,0 +1,195 @@
+"""
+
+Benchmark of the calendar pipeline
+
+Generates synthetic member calendars, serves them from a local http server and measures every stage of
+the pipeline on them: fetch, parse, expand, tz-normalise, invert and serialise, followed by a complete cycle of
+all outputs of app/pipelines.json with an empty and with a filled event store.
+Every stage is repeated and the median and minimum are reported in seconds.
+
+Usage:
+    python benchmark/run.py --members 5 --events 2000 --save benchmark/baseline.json
+    python benchmark/run.py --members 5 --events 2000 --baseline benchmark/baseline.json
+
+With --baseline the exit code is 1 if the median of a stage got slower than the baseline by more than
+the tolerance, so the benchmark can guard a change against performance regressions.
+
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import feeds
+import server
+
+app_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.append(app_dir)
+
+STAGES = ["fetch", "fetch_revalidate", "parse", "expand", "tz_normalise", "invert", "serialise", "cycle_cold", "cycle_warm"]
+# stages that are faster than this many seconds are never reported as regression, their differences are noise
+NOISE_FLOOR = 0.005
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measures the stages of the calendar pipeline on synthetic calendars.")
+    parser.add_argument("--members", type=int, default=3, help="number of member calendars")
+    parser.add_argument("--events", type=int, default=500, help="number of VEVENT components per calendar")
+    parser.add_argument("--recurring", type=float, default=0.1, help="share of recurring events")
+    parser.add_argument("--history", type=float, default=3, help="years of past events")
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds every response of the server is delayed")
+    parser.add_argument("--failures", type=float, default=0, help="share of requests the server answers with 503")
+    parser.add_argument("--window", default="two_months", help="window of the stage measurements, see pipeline.WINDOWS")
+    parser.add_argument("--repeat", type=int, default=3, help="number of measurements per stage")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated calendars")
+    parser.add_argument("--save", help="writes the results as json to this path")
+    parser.add_argument("--baseline", help="compares the results with the json results at this path")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown compared to the baseline")
+    return parser.parse_args()
+
+
+def measure(timings, stage, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def get_pipeline_config(urls):
+    """
+    Returns the config of app/pipelines.json with the generated calendars as the only source of every output.
+    """
+    import pipeline
+    config = pipeline.load_config(os.path.join(app_dir, pipeline.CONFIG))
+    config["sources"] = {"benchmark": {"links": urls}}
+    for output in config["outputs"].values():
+        for branch in output["branches"]:
+            branch["sources"] = ["benchmark"]
+    return config
+
+
+def run_round(timings, counts, urls, window_name):
+    # the modules are imported after the working directory changed, they use relative paths
+    import recurring_ical_events
+    import conanbot
+    import eventstore
+    import fetcher
+    import icsparse
+    import intervals
+    import pipeline
+
+    shutil.rmtree(fetcher.CACHE_DIR, ignore_errors=True)
+    fetched = measure(timings, "fetch", fetcher.fetch_all, urls)
+    measure(timings, "fetch_revalidate", fetcher.fetch_all, urls)
+    bodies = [feed.body for feed in fetched.values() if feed is not None]
+    counts["failed_fetches"] = len(urls) - len(bodies)
+
+    start, end = pipeline.WINDOWS[window_name](datetime.datetime.now(pipeline.TIMEZONE))
+    calendars = measure(timings, "parse", lambda: [icsparse.parse_calendar_between(body, start, end) for body in bodies])
+    occurrences = measure(timings, "expand", lambda: [recurring_ical_events.of(cal, components=["VEVENT"]).between(start, end)
+                                                      for cal in calendars])
+    records = measure(timings, "tz_normalise", lambda: [eventstore.to_records(events, None, eventstore.get_recurring_uids(cal))[0]
+                                                        for cal, events in zip(calendars, occurrences)])
+    counts["occurrences"] = sum(len(events) for events in occurrences)
+
+    def invert():
+        sleep_times = conanbot.generate_sleep_intervals(start, end)
+        busy_times = [intervals.merge(intervals.from_pairs((record[2], record[3]) for record in member_records if not record[4]))
+                      for member_records in records]
+        start_time, end_time = int(start.timestamp()), int(end.timestamp())
+        free_times = intervals.complement(intervals.union(sleep_times, *busy_times), start_time, end_time)
+        intervals.find_times_with_free_participants([intervals.union(busy, sleep_times) for busy in busy_times],
+                                                    max(len(busy_times) - 1, 1), start_time, end_time)
+        return intervals.filter_by_duration(free_times, 150 * 60)
+    free_times = measure(timings, "invert", invert)
+    counts["free_times"] = len(free_times[0])
+
+    def serialise():
+        events = [event for events in occurrences for event in events]
+        events += conanbot.create_ical_events_from_timespans(intervals.to_datetimes(free_times, start.tzinfo))
+        return conanbot.generate_new_icalendar("Benchmark", [], events).to_ical()
+    counts["serialised_bytes"] = len(measure(timings, "serialise", serialise))
+
+    # a complete cycle of all outputs, first with an empty event store and then with the filled one
+    config = get_pipeline_config(urls)
+    if os.path.exists(eventstore.DATABASE):
+        os.remove(eventstore.DATABASE)
+    for stage in ("cycle_cold", "cycle_warm"):
+        try:
+            measure(timings, stage, pipeline.run, list(config["outputs"]), config)
+        except RuntimeError as e:
+            # outputs whose sources could not be fetched fail, the cycle is measured anyway
+            timings.setdefault(stage, []).append(float("nan"))
+            print(e)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of every stage compared to the baseline and returns the stages that got slower than the tolerance.
+    """
+    regressions = []
+    for stage in STAGES:
+        if stage not in results["stages"] or stage not in baseline["stages"]:
+            continue
+        current = results["stages"][stage]["median"]
+        before = baseline["stages"][stage]["median"]
+        change = (current - before) / before if before else 0
+        regressed = current > before * (1 + tolerance) and current - before > NOISE_FLOOR
+        print("{:<18} {:>10.4f} {:>10.4f} {:>+8.1%}{}".format(stage, before, current, change, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    arguments = parse_arguments()
+    generated = feeds.generate_feeds(arguments.members, arguments.events, arguments.recurring, arguments.history, seed=arguments.seed)
+    feed_server = server.FeedServer(generated, arguments.latency / 1000, arguments.failures, arguments.seed).start()
+    urls = [feed_server.get_url(name) for name in generated]
+
+    timings = {}
+    counts = {"members": arguments.members, "events": arguments.events * arguments.members,
+              "feed_bytes": sum(len(body.encode("utf-8")) for body in generated.values())}
+    original_dir = os.getcwd()
+    working_dir = tempfile.mkdtemp(prefix="conanbot-benchmark-")
+    os.makedirs(os.path.join(working_dir, "log"))
+    os.chdir(working_dir)
+    try:
+        for _ in range(arguments.repeat):
+            run_round(timings, counts, urls, arguments.window)
+    finally:
+        feed_server.shutdown()
+        os.chdir(original_dir)
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+    results = {
+        "parameters": {key: value for key, value in vars(arguments).items() if key not in ("save", "baseline", "tolerance")},
+        "counts": counts,
+        "stages": {stage: {"median": statistics.median(timings[stage]), "min": min(timings[stage]), "runs": timings[stage]}
+                   for stage in STAGES if stage in timings}
+    }
+    print(json.dumps({"counts": counts}, indent=2))
+    for stage, timing in results["stages"].items():
+        print("{:<18} median {:>9.4f} s   min {:>9.4f} s".format(stage, timing["median"], timing["min"]))
+
+    if arguments.save:
+        with open(arguments.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != results["parameters"]:
+            print("The baseline was recorded with other parameters: " + json.dumps(baseline["parameters"]))
+        print("{:<18} {:>10} {:>10} {:>8}".format("stage", "baseline", "current", "change"))
+        if compare(results, baseline, arguments.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
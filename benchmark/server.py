@@ -0,0 +1,75 @@
+"""
+
+Local calendar server
+
+Serves generated feeds over http on localhost with an injectable latency and failure rate, so fetching
+can be measured without the real calendar servers. Every feed has a strong ETag and conditional requests
+are answered with 304 like a real CalDAV server does.
+
+"""
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FeedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, feeds, latency=0.0, failure_rate=0.0, seed=0):
+        """
+        :param feeds: A dictionary that maps file names to the content of the ics files
+        :param latency: Seconds every response is delayed
+        :param failure_rate: The share of requests that are answered with 503
+        :param seed: The seed of the random generator that decides about failures
+        """
+        super().__init__(("127.0.0.1", 0), FeedHandler)
+        self.feeds = {}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.set_feeds(feeds)
+
+    def set_feeds(self, feeds):
+        self.feeds = {"/" + name: (body.encode("utf-8"), '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"')
+                      for name, body in feeds.items()}
+
+    def should_fail(self):
+        with self.random_lock:
+            return self.random.random() < self.failure_rate
+
+    def get_url(self, name):
+        return "http://127.0.0.1:" + str(self.server_address[1]) + "/" + name
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if self.path not in self.server.feeds:
+            self.send_error(404)
+            return
+        if self.server.should_fail():
+            self.send_error(503)
+            return
+        body, etag = self.server.feeds[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -9,6 +9,8 @@ from icalevents.icalevents import events
 
 import urllib.request
 
+import calendardata
+
 def fetchICAL(url):
     f = urllib.request.urlopen(url)
     myfile = f.read()
@@ -118,18 +120,18 @@ def generate_instruction_table(start, end, events):
             # write action while event
             duration = events[i].end - events[i].start
             duration_in_milliseconds = duration.total_seconds() * 1000
-            # find out which key of the color_table keys are in the description
-            keys = [key for key in color_table.keys() if key in events[i].description]
+            # find out which key of the color_table keys are in the categories
+            keys = [key for key in color_table.keys() if key in events[i].categories]
             if keys:
                 output += "{:.0f}".format(duration_in_milliseconds) + " " + color_table[keys[0]] + "<br>"
             else:
                 output += "{:.0f}".format(duration_in_milliseconds) + " 255 255 255<br>"
-                print("There is no color for: " + events[i].description)
+                print("There is no color for: " + events[i].categories)
             # find next event
             if i < len(events) - 1:
                 j = i + 1
                 # skip events that start inbetween
-                while events[j].start < events[i].end:
+                while j < len(events) - 1 and events[j].start < events[i].end:
                     j+=1
                 # write action after event
                 duration = events[j].start - events[i].end
@@ -153,27 +155,12 @@ def display_events(events):
 
 def generate_site():
     site = ""
-    cal = Calendar.from_ical(fetchICAL("https://time.ludattel.de/calendar/subscribe/ludwigskombilender"))
-    sessions = [e for e in cal.walk('vevent')]
-    print(len(sessions))
-    span_events = []
-    # ignore full day events
-    for event in sessions:
-        if isinstance(event['DTSTART'].dt, datetime):
-            event['DESCRIPTION'] = event['CATEGORIES']
-            span_events.append(event)
-
-    cal = Calendar()
-    for event in span_events:
-        cal.add_component(event)
-
-
-    #display_events(span_events)
 
     today = datetime.now(tz=timezone(timedelta(0)))
     tommorrow =  today + timedelta(hours=24)
 
-    sessions = events(string_content=cal.to_ical(), start=today, end=tommorrow)
+    # read the latest generated events of the combined calendar, full day events are ignored
+    sessions = calendardata.get_events_between("ludwigskombilender", today, tommorrow)
     
     #sessions = find_sessions_inbetween(sessions, today, tommorrow+timedelta(2))
 
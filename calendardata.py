@@ -0,0 +1,122 @@
+import json
+import os
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date, datetime
+
+import pytz
+
+# directory in which the calendar bot publishes its calendars
+CALENDAR_DIR = "app"
+
+# timezone of full day events and of times without an utc offset
+timezone = pytz.timezone("Europe/Berlin")
+
+# a single event of a generated calendar, start and end are timezone-aware datetime objects
+CalendarEvent = namedtuple("CalendarEvent", ["id", "title", "start", "end", "color", "categories", "allday"])
+
+# the events of a calendar sorted by their start together with the epoch seconds of their starts and ends,
+# the longest duration of an event and the compact json representation of every event
+CalendarIndex = namedtuple("CalendarIndex", ["events", "starts", "ends", "max_duration", "compact"])
+
+# indices by calendar name together with the modification time of their file
+snapshots = {}
+
+
+def parse_time(value):
+    """
+    Parses a time as written by conanbot.export_calendar_as_json.
+    Returns the timezone-aware datetime and whether the value was a date without a time,
+    dates and floating times are interpreted in the local timezone.
+    """
+    if len(value) <= 10:
+        return timezone.localize(datetime.combine(date.fromisoformat(value), datetime.min.time())), True
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = timezone.localize(value)
+    return value, False
+
+
+def to_timestamp(value):
+    """
+    Returns the epoch seconds of a datetime, times without an utc offset are interpreted in the local timezone.
+    """
+    if value.tzinfo is None:
+        value = timezone.localize(value)
+    return value.timestamp()
+
+
+def get_index(calendar):
+    """
+    Returns the index of the latest generated events of a calendar. The snapshot is read from disk and
+    the index is built only if the calendar was published again since the last call.
+
+    :param calendar: The name of the calendar, e.g. "ludwigskombilender"
+    :return: A CalendarIndex
+    """
+    path = os.path.join(CALENDAR_DIR, calendar + ".json")
+    mtime = os.stat(path).st_mtime_ns
+    cached = snapshots.get(calendar)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'r') as f:
+        raw_events = json.load(f)
+    entries = []
+    for raw_event in raw_events:
+        start, allday = parse_time(raw_event["start"])
+        end, _ = parse_time(raw_event["end"])
+        event = CalendarEvent(raw_event["id"], raw_event["title"], start, end, raw_event.get("color"),
+                              raw_event.get("categories") or "", allday)
+        # only the fields FullCalendar needs, empty fields are left out
+        compact = {key: value for key, value in (("id", raw_event["id"]), ("title", raw_event["title"]),
+                                                 ("start", raw_event["start"]), ("end", raw_event["end"]),
+                                                 ("color", raw_event.get("color"))) if value}
+        if allday:
+            compact["allDay"] = True
+        entries.append((to_timestamp(start), to_timestamp(end), event, compact))
+    entries.sort(key=lambda entry: entry[0])
+
+    index = CalendarIndex([entry[2] for entry in entries], [entry[0] for entry in entries], [entry[1] for entry in entries],
+                          max((entry[1] - entry[0] for entry in entries), default=0), [entry[3] for entry in entries])
+    snapshots[calendar] = (mtime, index)
+    return index
+
+
+def find_overlapping(index, start, end):
+    """
+    Returns the positions of all events of the index that overlap the timespan between start and end (epoch seconds).
+    No event starts earlier than its longest duration before the timespan, so only the events between this
+    point and the end of the timespan are checked.
+    """
+    first = bisect_left(index.starts, start - index.max_duration)
+    last = bisect_left(index.starts, end)
+    return [i for i in range(first, last) if index.ends[i] > start or index.starts[i] >= start]
+
+
+def get_events_between(calendar, start, end):
+    """
+    Returns all timed events of a calendar that overlap the timespan between start and end.
+
+    :param calendar: The name of the calendar
+    :param start: A timezone-aware datetime object
+    :param end: A timezone-aware datetime object
+    :return: A list of CalendarEvent objects
+    """
+    index = get_index(calendar)
+    events = [index.events[i] for i in find_overlapping(index, start.timestamp(), end.timestamp())]
+    return [event for event in events if not event.allday and event.start < end and event.end > start]
+
+
+def get_compact_events_between(calendar, start, end):
+    """
+    Returns the compact json representation of all events of a calendar, including full day events,
+    that overlap the timespan between start and end.
+
+    :param calendar: The name of the calendar
+    :param start: A datetime object, times without an utc offset are interpreted in the local timezone
+    :param end: A datetime object, times without an utc offset are interpreted in the local timezone
+    :return: A list of dictionaries
+    """
+    index = get_index(calendar)
+    return [index.compact[i] for i in find_overlapping(index, to_timestamp(start), to_timestamp(end))]
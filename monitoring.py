@@ -0,0 +1,131 @@
+import json
+import os
+import time
+
+# file in which the calendar bot writes its metrics and the state of its jobs (see app/metrics.py)
+METRICS_PATH = os.path.join("app", "metrics.json")
+# the calendar bot writes its metrics at least every 15 seconds, older metrics mean that it is not running
+MAX_METRICS_AGE = 120
+PREFIX = "conanbot_"
+
+# metrics of the last snapshot together with the modification time of their file
+snapshot = {"mtime": None, "metrics": None}
+
+
+def load_metrics():
+    """
+    Returns the last metrics written by the calendar bot or None if there are none. The file is read from disk
+    only if it was written again since the last call.
+    """
+    try:
+        mtime = os.stat(METRICS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if snapshot["mtime"] != mtime:
+        try:
+            with open(METRICS_PATH, 'r') as f:
+                snapshot["metrics"] = json.load(f)
+        except (OSError, ValueError):
+            return snapshot["metrics"]
+        snapshot["mtime"] = mtime
+    return snapshot["metrics"]
+
+
+def is_pipeline_running(metrics, now=None):
+    return metrics is not None and (now or time.time()) - metrics["time"] <= MAX_METRICS_AGE
+
+
+def get_job_health(job, now=None):
+    """
+    Returns the health of a job: ok, pending (it never finished yet), failing (its last run failed),
+    timeout (the running run exceeded its timeout) or stale (it did not succeed for more than two intervals).
+    """
+    now = now or time.time()
+    if job["timed_out"]:
+        return "timeout"
+    if job["last_result"] == "failure":
+        return "failing"
+    if job["last_success"] is None:
+        return "pending"
+    if now - job["last_success"] > 2 * job["interval"] + job["timeout"]:
+        return "stale"
+    return "ok"
+
+
+def get_status():
+    """
+    Returns the overall status of the calendar bot (success, failed or not running) and the health of every job.
+    """
+    metrics = load_metrics()
+    now = time.time()
+    if not is_pipeline_running(metrics, now):
+        return "not running", {}
+    jobs = {}
+    for name, job in metrics["jobs"].items():
+        jobs[name] = {
+            "health": get_job_health(job, now),
+            "running": job["running"],
+            "last_success": job["last_success"],
+            "last_duration": job["last_duration"],
+            "last_lag": job["last_lag"],
+            "last_error": job["last_error"],
+            "runs": job["runs"],
+            "failures": job["failures"]
+        }
+    healthy = all(job["health"] in ("ok", "pending") for job in jobs.values())
+    return "success" if healthy else "failed", jobs
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(key + "=\"" + value + "\"" for key, value in zip(labels.keys(), escaped)) + "}"
+
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """
+    Renders the metrics of the calendar bot in the Prometheus text format.
+    """
+    metrics = load_metrics()
+    now = time.time()
+    # samples by metric name: (type, [(suffix, labels, value)])
+    families = {}
+
+    def add(name, metric_type, labels, value, suffix=""):
+        families.setdefault(PREFIX + name, (metric_type, []))[1].append((suffix, labels, value))
+
+    add("up", "gauge", {}, 1 if is_pipeline_running(metrics, now) else 0)
+    if metrics is not None:
+        add("metrics_age_seconds", "gauge", {}, now - metrics["time"])
+        for name, labels, value in metrics["counters"]:
+            add(name, "counter", labels, value)
+        for name, labels, value in metrics["gauges"]:
+            add(name, "gauge", labels, value)
+        for name, labels, count, total in metrics["summaries"]:
+            add(name, "summary", labels, total, "_sum")
+            add(name, "summary", labels, count, "_count")
+        for job_name, job in metrics["jobs"].items():
+            labels = {"job": job_name}
+            add("job_running", "gauge", labels, 1 if job["running"] else 0)
+            add("job_healthy", "gauge", labels, 1 if get_job_health(job, now) in ("ok", "pending") else 0)
+            add("job_last_duration_seconds", "gauge", labels, job["last_duration"])
+            add("job_lag_seconds", "gauge", labels, job["last_lag"])
+            add("job_last_success_timestamp_seconds", "gauge", labels, job["last_success"])
+            add("job_runs_total", "counter", labels, job["runs"])
+            add("job_failures_total", "counter", labels, job["failures"])
+            add("job_timeouts_total", "counter", labels, job["timeouts"])
+            add("job_skipped_total", "counter", labels, job["skipped"])
+
+    lines = []
+    for name, (metric_type, samples) in sorted(families.items()):
+        lines.append("# TYPE " + name + " " + metric_type)
+        for suffix, labels, value in samples:
+            lines.append(name + suffix + format_labels(labels) + " " + format_value(value))
+    return "\n".join(lines) + "\n"